@@ -18,6 +18,7 @@ from requests.exceptions import HTTPError
 from collections import defaultdict
 import hashlib
 import threading
+import queue
 ######################################################################
 
 def slug(text):
@@ -47,6 +48,16 @@ VALID_CATEGORIES = {
 
 # UPDATED: Brand extraction mapping
 BRANDS = ['HP', 'Dell', 'IBM', 'Lenovo', 'Apple', 'Cisco', 'Avaya', 'Intel', 'AMD']
+BRANDS_LOWER = [(brand.lower(), brand) for brand in BRANDS]  # lowercased once, not per product
+
+# 6 WooCommerce attributes (24 columns). Names and flags are fixed, only values vary per product
+ATTRIBUTE_NAMES = ['Brand', 'Processor', 'RAM', 'Graphics', 'Generation', 'Operating System']
+ATTRIBUTE_TEMPLATE = {}
+for _i, _attr_name in enumerate(ATTRIBUTE_NAMES, 1):
+    ATTRIBUTE_TEMPLATE[f'Attribute {_i} name'] = _attr_name
+    ATTRIBUTE_TEMPLATE[f'Attribute {_i} value(s)'] = ''
+    ATTRIBUTE_TEMPLATE[f'Attribute {_i} visible'] = '1'
+    ATTRIBUTE_TEMPLATE[f'Attribute {_i} global'] = '1'
 
 #-----------------------------------------------------------------------------------------------
 def generate_unique_id(prefix="SMS"):
@@ -333,14 +344,29 @@ def get_products_from_category(category_url, session):
 #-----------------------------------------------------------------------------------------------
 def download_image(img_url, img_path, session):
     """Helper function to download a single image using the session."""
+    # Skip images already downloaded by a previous run. Downloads go to a .part file that
+    # is only renamed into place once complete, so an existing img_path is never truncated.
+    # Empty files left by runs before that are fetched again.
+    try:
+        if os.stat(img_path).st_size > 0:
+            return img_path
+    except FileNotFoundError:
+        pass
+
+    part_path = img_path + ".part"
     try:
         time.sleep(random.uniform(1.0, 2.0))
         with session.get(img_url, stream=True, timeout=15) as r:
             r.raise_for_status()
-            with open(img_path, 'wb') as f:
+            with open(part_path, 'wb') as f:
                 shutil.copyfileobj(r.raw, f)
+        os.replace(part_path, img_path)
         return img_path
     except Exception as e:
+        try:
+            os.remove(part_path)
+        except FileNotFoundError:
+            pass
         return None
 
 #-----------------------------------------------------------------------------------------------
@@ -350,8 +376,8 @@ def extract_brand(product_name, category_path):
     cat_lower = category_path.lower()
     
     # UPDATED: Check against expanded brand list
-    for brand in BRANDS:
-        if brand.lower() in name_lower or brand.lower() in cat_lower:
+    for brand_lower, brand in BRANDS_LOWER:
+        if brand_lower in name_lower or brand_lower in cat_lower:
             return brand
     
     # Try to extract first word as brand if it looks like a brand name
@@ -618,21 +644,13 @@ def scrape_product_details(url, session, today_folder, category_path):
             data['Output Wattage'] = f"{watt_match.group(1)}W"
     
     # UPDATED: Initialize 6 attributes with extracted data
-    attributes = {}
-    attr_config = [
-        ('Brand', data['Brand']),
-        ('Processor', data['Processor']),
-        ('RAM', data['Ram size']),
-        ('Graphics', data['Graphics size']),
-        ('Generation', data['Generation(s)']),
-        ('Operating System', data['Operating system'])
-    ]
-    
-    for i, (attr_name, attr_value) in enumerate(attr_config, 1):
-        attributes[f'Attribute {i} name'] = attr_name
-        attributes[f'Attribute {i} value(s)'] = attr_value
-        attributes[f'Attribute {i} visible'] = '1'
-        attributes[f'Attribute {i} global'] = '1'
+    attributes = ATTRIBUTE_TEMPLATE.copy()
+    attributes['Attribute 1 value(s)'] = data['Brand']
+    attributes['Attribute 2 value(s)'] = data['Processor']
+    attributes['Attribute 3 value(s)'] = data['Ram size']
+    attributes['Attribute 4 value(s)'] = data['Graphics size']
+    attributes['Attribute 5 value(s)'] = data['Generation(s)']
+    attributes['Attribute 6 value(s)'] = data['Operating system']
     
     data.update(attributes)
     
@@ -666,24 +684,16 @@ def main():
 
     # Collect all unique products with their first category
     products_dict = {}  # url -> category_path mapping
-    cat_index = 0
+    subcat_jobs = [subcat for cat in categories for subcat in cat['subcategories']]
     
-    for cat in categories:
-        cat_index += 1
-        subcats = cat['subcategories']
-        cat_name = cat['name']
+    # Subcategory listings are independent, so fetch them in parallel.
+    # executor.map yields in submission order, so each product still keeps its first category.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+        listings = executor.map(lambda subcat: get_products_from_category(subcat['url'], session), subcat_jobs)
         
-        print(f"\n[{cat_index}/{total_cats}] Processing category: {cat_name}")
-        
-        for s_index, subcat in enumerate(subcats, start=1):
-            sub_name = subcat['name']
-            sub_url = subcat['url']
+        for s_index, (subcat, products) in enumerate(zip(subcat_jobs, listings), start=1):
             category_path = subcat['path']
-            
-            print(f"  [{s_index}/{len(subcats)}] Fetching products from: {category_path}")
-            
-            products = get_products_from_category(sub_url, session)
-            print(f"  └─ Found {len(products)} products")
+            print(f"  [{s_index}/{total_subcats}] {category_path}: found {len(products)} products")
             
             for prod_url in products:
                 # Only add product if not already seen (keeps first category)
@@ -707,47 +717,60 @@ def main():
     ]
     
     # Add 6 attribute columns (24 fields total)
-    attribute_fieldnames = []
-    for i in range(1, 7):
-        attribute_fieldnames.extend([
-            f'Attribute {i} name',
-            f'Attribute {i} value(s)',
-            f'Attribute {i} visible',
-            f'Attribute {i} global'
-        ])
-    
-    fieldnames = base_fieldnames + attribute_fieldnames
+    fieldnames = base_fieldnames + list(ATTRIBUTE_TEMPLATE)
     
     # Scrape all product details
-    with open(csv_filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        print("\n[INFO] Scraping product details...")
-        
+    # Workers hand finished rows to a dedicated writer thread through a bounded
+    # queue, so CSV writes never hold up collecting results.
+    row_queue = queue.Queue(maxsize=200)
+
+    # Opened here rather than in the writer thread, so a bad path or full disk fails the
+    # run right away instead of leaving the workers blocked on a queue nobody drains
+    csvfile = open(csv_filename, 'w', newline='', encoding='utf-8-sig')
+    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    writer.writeheader()
+
+    def csv_writer():
+        written = 0
+        while True:
+            item = row_queue.get()
+            if item is None:
+                break
+            url, row = item
+            # A bad row must not kill this thread: workers would block on the full queue
+            try:
+                writer.writerow(row)
+                written += 1
+                if written % 50 == 0:
+                    csvfile.flush()
+            except Exception as e:
+                print(f"\n[ERROR] Failed to write {url}: {e}")
+
+    def scrape_and_queue(prod):
+        details = scrape_product_details(prod['url'], session, today_folder, prod['category'])
+        if details:
+            row_queue.put((prod['url'], details))
+
+    writer_thread = threading.Thread(target=csv_writer, daemon=True)
+    writer_thread.start()
+
+    print("\n[INFO] Scraping product details...")
+
+    try:
         with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            future_to_prod = {
-                executor.submit(
-                    scrape_product_details, 
-                    prod['url'], 
-                    session, 
-                    today_folder,
-                    prod['category']
-                ): prod
-                for prod in all_products
-            }
-            
+            future_to_prod = {executor.submit(scrape_and_queue, prod): prod for prod in all_products}
+
             for future in tqdm(concurrent.futures.as_completed(future_to_prod), total=len(all_products)):
                 try:
-                    prod = future_to_prod[future]
-                    details = future.result()
-                    
-                    if details:
-                        writer.writerow(details)
-                        csvfile.flush()
+                    future.result()
                 except Exception as e:
                     prod = future_to_prod[future]
                     print(f"\n[ERROR] Failed to process {prod['url']}: {e}")
+    finally:
+        # Sentinel: let the writer drain what is queued, then close the file
+        row_queue.put(None)
+        writer_thread.join()
+        csvfile.close()
 
     print(f"\n[INFO] Done! CSV: {csv_filename} | Images: {today_folder}")
     print(f"[INFO] Final cache stats: {CACHE_HITS} hits, {CACHE_MISSES} misses")
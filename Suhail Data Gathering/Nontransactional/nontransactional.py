@@ -0,0 +1,914 @@
+################################################################################
+import requests
+import csv
+import time
+import sys
+import json
+import os
+import atexit
+import random
+import threading
+import signal
+import mercantile
+import mapbox_vector_tile
+import shutil
+import datetime
+import re # Added for data cleaning
+from collections import deque, Counter
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import quote
+try:
+    import orjson # Optional: much faster JSON encoding/decoding
+except ImportError:
+    orjson = None
+try:
+    import httpx # Optional: HTTP/2 tile downloads (pip install "httpx[http2]")
+except ImportError:
+    httpx = None
+################################################################################
+
+REGION_IDS = [2, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15]
+MAP_NAMES = {
+    2: "makkah_region", 4: "al_qassim", 5: "eastern_region", 6: "asir_region",
+    7: "tabuk", 8: "hail", 9: "northern_borders", 10: "riyadh",
+    11: "najran", 12: "bahah", 13: "al_madenieh", 14: "jazan", 15: "jawf"
+}
+
+# # Test with one city
+# REGION_IDS = [12]
+# MAP_NAMES = {12: "bahah"}
+
+ZOOM_LEVEL = 15
+PARCELS_FILE = "non_transactional_parcels.csv"
+SEEN_IDS_DIR = "seen_ids" # Per-region ids already written, read back when resuming
+ETAGS_FILE = "tile_etags.json" # Tile ETags of fully scanned regions, for conditional GETs when resuming
+# SUHAIL_RESUME=1 appends to PARCELS_FILE and skips parcels written by an earlier run
+RESUME = os.environ.get("SUHAIL_RESUME", "") == "1"
+# Decided once: without the earlier CSV there is nothing to resume into, and seen ids
+# or ETags from a previous run would only make this one skip parcels it never wrote
+RESUMING = RESUME and os.path.exists(PARCELS_FILE)
+REGIONS_URL = "https://api2.suhail.ai/regions"
+PARCEL_DETAILS_URL = "https://api2.suhail.ai/api/parcel/search"
+# Prebuilt query string, so requests doesn't re-encode a params dict on every lookup
+PARCEL_DETAILS_TMPL = (PARCEL_DETAILS_URL + "?regionId={region_id}&provinceId={province_id}"
+                       "&subdivisionNo={subdivision_no}&parcelNo={parcel_no}&offset=0&limit=1")
+
+# Performance settings
+MAX_WORKERS_TILES = 60  
+MAX_WORKERS_ENRICH = 40 
+MAX_WORKERS_PROBE = 40   # Concurrent province probes for parcels without a province id
+PROBE_BATCH = 2          # Provinces probed at once per parcel; every extra probe spends API_QPS
+REQUEST_TIMEOUT = 10
+# Request rate caps in requests/second (0 disables), overridable from the environment
+TILE_QPS = float(os.environ.get("SUHAIL_TILE_QPS", 50))
+API_QPS = float(os.environ.get("SUHAIL_QPS", 20))
+# Upper bounds for the adaptive in-flight request limits
+MAX_CONCURRENCY_TILES = MAX_WORKERS_TILES
+MAX_CONCURRENCY_API = 40
+
+################################################################################
+class ConsoleLogger:
+    GREEN = '\033[92m'
+    BLUE = '\033[94m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.last_update = 0
+        # Terminal width is cached and only re-read when the terminal is resized
+        self.width = shutil.get_terminal_size().columns
+        if hasattr(signal, 'SIGWINCH'): # Not available on Windows
+            try:
+                signal.signal(signal.SIGWINCH, self._on_resize)
+            except ValueError: # Only the main thread can install handlers
+                pass
+
+    def _on_resize(self, signum, frame):
+        self.width = shutil.get_terminal_size().columns
+
+    def _get_timestamp(self):
+        return datetime.datetime.now().strftime("%H:%M:%S")
+
+    def _emit(self, text):
+        """Clears the progress line and writes text with a single write"""
+        sys.stdout.write("\r" + " " * self.width + "\r" + text)
+        sys.stdout.flush()
+
+    def info(self, msg):
+        self._emit(f"[{self.BLUE}{self._get_timestamp()}{self.RESET}] {msg}\n")
+
+    def success(self, msg):
+        self._emit(f"[{self.GREEN}{self._get_timestamp()}{self.RESET}] {self.GREEN}✓ {msg}{self.RESET}\n")
+
+    def warning(self, msg):
+        self._emit(f"[{self.YELLOW}{self._get_timestamp()}{self.RESET}] {self.YELLOW}⚠ {msg}{self.RESET}\n")
+
+    def error(self, msg):
+        self._emit(f"[{self.RED}{self._get_timestamp()}{self.RESET}] {self.RED}✖ {msg}{self.RESET}\n")
+
+    def section(self, title):
+        width = self.width
+        self._emit(f"\n{self.BOLD}{'='*width}{self.RESET}\n"
+                   f"{self.BOLD} {title.center(width)} {self.RESET}\n"
+                   f"{self.BOLD}{'='*width}{self.RESET}\n")
+
+    def _clear_line(self):
+        self._emit("")
+
+    def progress_bar(self, current, total, stats_dict, prefix='Progress'):
+        now = time.time()
+        if current < total and (now - self.last_update < 0.2):
+            return
+        self.last_update = now
+
+        percent = float(current) * 100 / total
+        bar_length = 25
+        filled_length = int(bar_length * current // total)
+        bar = '█' * filled_length + '░' * (bar_length - filled_length)
+        
+        elapsed = time.time() - self.start_time
+        rate = current / elapsed if elapsed > 0 else 0
+        remaining = total - current
+        eta = remaining / rate if rate > 0 else 0
+        eta_str = str(datetime.timedelta(seconds=int(eta)))
+
+        stats_str = (f"F:{self.GREEN}{stats_dict['found']}{self.RESET} "
+                     f"E:{self.BLUE}{stats_dict['enriched']}{self.RESET} "
+                     f"X:{self.RED}{stats_dict['errors']}{self.RESET}")
+
+        sys.stdout.write(f"\r{prefix} |{bar}| {percent:.1f}% [{current}/{total}] {stats_str} | ETA: {eta_str}")
+        sys.stdout.flush()
+
+################################################################################
+class StatsTracker:
+    def __init__(self):
+        self.tiles_processed = 0
+        self.tiles_with_data = 0
+        self.parcels_found = 0
+        self.parcels_enriched = 0
+        self.errors = 0
+    
+    def to_dict(self):
+        return {
+            "found": self.parcels_found,
+            "enriched": self.parcels_enriched,
+            "errors": self.errors
+        }
+
+logger = ConsoleLogger()
+
+################################################################################
+class JitteredRetry(Retry):
+    """
+    Full-jitter backoff: sleeps a random time between 0 and the exponential delay,
+    so the enrich threads don't all retry a 503 in the same instant.
+    """
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+def create_session():
+    s = requests.Session()
+    retries = JitteredRetry(
+        total=3, backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True
+    )
+    s.mount('https://', HTTPAdapter(max_retries=retries, pool_connections=100, pool_maxsize=100))
+    return s
+
+session = create_session()
+
+class StatusRetryClient:
+    """
+    httpx's transport only retries failed connections. This adds what the requests
+    session gets from JitteredRetry: 429 and 5xx responses are retried with full-jitter
+    backoff (or after Retry-After when the server sends one), and redirects are followed.
+    """
+    STATUS_FORCELIST = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, client, total, backoff_factor):
+        self.client = client
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.retry = JitteredRetry(total=total, backoff_factor=backoff_factor) # Retry-After parsing
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("follow_redirects", True)
+        for attempt in range(self.total + 1):
+            resp = self.client.get(url, **kwargs)
+            if resp.status_code not in self.STATUS_FORCELIST or attempt == self.total:
+                return resp
+            retry_after = resp.headers.get("Retry-After")
+            try:
+                delay = self.retry.parse_retry_after(retry_after) if retry_after else None
+            except Exception: # Malformed header: fall back to backoff
+                delay = None
+            if delay is None:
+                delay = random.uniform(0, self.backoff_factor * (2 ** attempt))
+            resp.close()
+            time.sleep(delay)
+
+    def close(self):
+        self.client.close()
+
+def create_tile_client():
+    """
+    Tiles are many small GETs to one host: with httpx[http2] installed they are
+    multiplexed over a few HTTP/2 connections shared by all tile threads.
+    Falls back to the pooled requests session otherwise.
+    """
+    if httpx:
+        try:
+            # Limits belong on the transport: the Client ignores its own once a transport is given
+            client = httpx.Client(transport=httpx.HTTPTransport(
+                http2=True, retries=3,
+                limits=httpx.Limits(max_connections=MAX_WORKERS_TILES, max_keepalive_connections=MAX_WORKERS_TILES)
+            ))
+            return StatusRetryClient(client, total=3, backoff_factor=0.3)
+        except ImportError: # httpx without the h2 extra
+            pass
+    return session
+
+tile_client = create_tile_client()
+
+################################################################################
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a request may be sent, so
+    the worker pools never go over the server's rate instead of running into
+    5xx/429s and retrying. A rate of 0 disables the limit.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0: return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+tile_limiter = TokenBucket(TILE_QPS)
+api_limiter = TokenBucket(API_QPS)
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on in-flight requests to one host. The outcomes of the last
+    WINDOW requests are kept; at most once a second the limit grows by one
+    while under 5% of them failed, and is halved when over 15% failed.
+    """
+    WINDOW = 200
+
+    def __init__(self, initial, maximum, minimum=1):
+        self.limit = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.outcomes = deque(maxlen=self.WINDOW)
+        self.last_adjust = time.monotonic()
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, ok):
+        with self.cond:
+            self.in_flight -= 1
+            self.outcomes.append(ok)
+            now = time.monotonic()
+            if now - self.last_adjust >= 1:
+                self.last_adjust = now
+                err_rate = self.outcomes.count(False) / len(self.outcomes)
+                if err_rate < 0.05:
+                    self.limit = min(self.maximum, self.limit + 1)
+                elif err_rate > 0.15:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.outcomes.clear() # Judge the new limit on fresh outcomes only
+            self.cond.notify_all()
+
+    def get(self, client, url, **kwargs):
+        """client.get() inside a concurrency slot; 5xx, 429 and exceptions count as failures"""
+        self.acquire()
+        ok = False
+        try:
+            resp = client.get(url, **kwargs)
+            ok = resp.status_code < 500 and resp.status_code != 429
+            return resp
+        finally:
+            self.release(ok)
+
+tile_concurrency = AdaptiveConcurrency(MAX_CONCURRENCY_TILES // 2, MAX_CONCURRENCY_TILES)
+api_concurrency = AdaptiveConcurrency(MAX_CONCURRENCY_API // 2, MAX_CONCURRENCY_API)
+
+################################################################################
+def json_dumps(obj):
+    """Compact UTF-8 JSON string (orjson when available, same output with stdlib json)"""
+    if orjson:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+def json_loads(content):
+    """Parses a raw response body without going through requests' text decoding"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+################################################################################
+def fetch_region_metadata():
+    logger.info("Connecting to Suhail API for region metadata...")
+    try:
+        resp = session.get(REGIONS_URL, timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        data = json_loads(resp.content).get("data", [])
+        
+        regions_dict = {}
+        provinces_dict = {}
+        
+        for region in data:
+            regions_dict[region["id"]] = region
+            for province in region.get("provinces", []):
+                provinces_dict[province["id"]] = province
+        
+        logger.success(f"Loaded metadata for {len(regions_dict)} regions.")
+        return regions_dict, provinces_dict
+    except Exception as e:
+        logger.error(f"Failed to fetch regions: {e}")
+        return {}, {}
+
+################################################################################
+def fetch_region_boundary(region_id, regions_dict):
+    region = regions_dict.get(region_id)
+    if not region: return None
+    bbox = region.get("restrictBoundaryBox", {})
+    sw, ne = bbox.get("southwest", {}), bbox.get("northeast", {})
+    if not all([sw.get("x"), sw.get("y"), ne.get("x"), ne.get("y")]): return None
+    return [sw.get("x"), sw.get("y"), ne.get("x"), ne.get("y")]
+
+################################################################################
+# Tile properties are scalars, so a hashed set lookup replaces the tuple scan
+EMPTY_VALUES = frozenset([None, '', 0, '0'])
+
+def safe_get(props, *keys):
+    """Basic getter: returns first non-empty value"""
+    for key in keys:
+        val = props.get(key)
+        if val not in EMPTY_VALUES:
+            return val
+    return ''
+
+def smart_get_text(props, *keys):
+    """
+    Enhanced getter: Checks multiple keys and PRIORITIZES text over numbers.
+    Used for land_use to avoid getting codes like '5555'.
+    """
+    candidates = []
+    for key in keys:
+        val = props.get(key)
+        if val not in EMPTY_VALUES:
+            s_val = str(val)
+            # If it's a pure number, store it as a backup
+            if s_val.isdigit():
+                candidates.append((0, s_val)) # Priority 0 (Low)
+            else:
+                candidates.append((1, s_val)) # Priority 1 (High - Text)
+    
+    if not candidates: return ''
+    # Sort by priority (descending), so text comes first
+    candidates.sort(key=lambda x: x[0], reverse=True)
+    return candidates[0][1]
+
+def parcel_key(pid):
+    """
+    Dedup key for a parcel id. Ids are numeric, and an int takes far less memory
+    in the seen set than the same id as a string. Non-numeric ids are kept as-is.
+    """
+    try:
+        return int(pid)
+    except (TypeError, ValueError):
+        return pid
+
+def _spread_bits(n):
+    """Spreads the low 32 bits of n out to the even bit positions"""
+    n &= 0xFFFFFFFF
+    n = (n | (n << 16)) & 0x0000FFFF0000FFFF
+    n = (n | (n << 8)) & 0x00FF00FF00FF00FF
+    n = (n | (n << 4)) & 0x0F0F0F0F0F0F0F0F
+    n = (n | (n << 2)) & 0x3333333333333333
+    n = (n | (n << 1)) & 0x5555555555555555
+    return n
+
+def morton(x, y):
+    """Z-order code: tiles close in (x, y) get close codes"""
+    return _spread_bits(x) | (_spread_bits(y) << 1)
+
+def clean_parcel_no(val):
+    """
+    Cleans parcel numbers.
+    - Rejects long names (e.g., 'Mohammed...')
+    - Rejects strings with no digits
+    """
+    if not val: return ''
+    s_val = str(val).strip()
+    
+    # Rule 1: Parcel numbers are usually short (< 15 chars)
+    # If it's very long, it's likely a description or name
+    if len(s_val) > 15:
+        return ''
+        
+    # Rule 2: Must contain at least one digit
+    if not any(char.isdigit() for char in s_val):
+        return ''
+        
+    return s_val
+
+################################################################################
+# Process pool for MVT decoding (CPU-bound, would otherwise serialize tile threads on the GIL).
+# Created in main(); when unset, tiles are decoded in the calling thread.
+decode_executor = None
+decode_executor_lock = threading.Lock()
+
+def decode_tile(content):
+    """
+    Decodes in the process pool. If a worker died the pool is broken for good,
+    so it is replaced once and this tile is decoded in the calling thread.
+    """
+    global decode_executor
+    pool = decode_executor
+    if not pool: return decode_tile_features(content)
+    try:
+        return pool.submit(decode_tile_features, content).result()
+    except BrokenProcessPool:
+        with decode_executor_lock:
+            if decode_executor is pool: # First thread to notice replaces it
+                logger.warning("Tile decode worker died, restarting the decode pool")
+                pool.shutdown(wait=False)
+                decode_executor = ProcessPoolExecutor()
+        return decode_tile_features(content)
+
+# Layer names are stored as plain strings in the MVT, so a tile none of these occur
+# in has no parcel layer at all ('parcel' also covers 'parcels' and 'parcels-base')
+PARCEL_LAYER_MARKERS = (b'parcel', b'land', b'neighborhoods')
+
+def has_parcel_layers(content):
+    """Cheap byte scan run before handing a tile to the decoder"""
+    if content[:2] == b'\x1f\x8b': return True # gzipped, can't tell without inflating
+    return any(marker in content for marker in PARCEL_LAYER_MARKERS)
+
+def decode_tile_features(content):
+    """
+    Decodes an MVT and returns the untransacted parcels of its parcel layers.
+    Runs in a decode worker process, so sold parcels and features without an id
+    are dropped before anything is sent back to the scraper.
+    """
+    decoded_tile = mapbox_vector_tile.decode(content)
+    
+    parcels_list = []
+    for layer_name in ['parcels', 'parcels-base', 'parcel', 'land', 'neighborhoods']:
+        if layer_name in decoded_tile:
+            for feature in decoded_tile[layer_name]['features']:
+                props = feature.get('properties') or {}
+                if int(props.get('transactions_count') or 0) > 0: continue
+                if not (props.get('parcel_objectid') or props.get('parcel_id')): continue
+                parcels_list.append({
+                    'properties': props,
+                    'geometry': feature.get('geometry'),
+                    'layer': layer_name
+                })
+    return parcels_list
+
+# url -> ETag. tile_etags only holds tiles of regions an earlier run finished (resume
+# mode); ETags seen this run wait in pending_etags until their region completes.
+# Tiles that failed to decode go to failed_tiles and never get an ETag committed.
+tile_etags = {}
+pending_etags = {}
+failed_tiles = set()
+
+def load_tile_etags():
+    """Only used when resuming into the CSV they were recorded for; a fresh run drops them"""
+    if not os.path.exists(ETAGS_FILE): return {}
+    if not RESUMING:
+        os.remove(ETAGS_FILE)
+        return {}
+    with open(ETAGS_FILE, 'rb') as f:
+        return json_loads(f.read())
+
+def commit_tile_etags(map_name):
+    """Called once a region is fully written: its tiles can be skipped on 304 from now on"""
+    marker = f"/maps/{map_name}/"
+    for url in list(pending_etags):
+        if marker in url:
+            tile_etags[url] = pending_etags.pop(url)
+    for url in failed_tiles:
+        tile_etags.pop(url, None)
+    with open(ETAGS_FILE, 'w', encoding='utf-8') as f:
+        f.write(json_dumps(tile_etags))
+
+def fetch_and_decode_tile(tile_coords, tile_url_template):
+    x, y, z = tile_coords
+    url = tile_url_template.format(z=z, x=x, y=y)
+    try:
+        tile_limiter.acquire()
+        headers = {'If-None-Match': tile_etags[url]} if url in tile_etags else None
+        resp = tile_concurrency.get(tile_client, url, timeout=4, headers=headers)
+        if resp.status_code == 304: return [] # Unchanged, its parcels are already in the CSV
+        if resp.status_code != 200: return []
+    except Exception:
+        return []
+
+    etag = resp.headers.get('ETag')
+    if len(resp.content) < 50 or not has_parcel_layers(resp.content):
+        features = []
+    else:
+        try:
+            features = decode_tile(resp.content)
+        except Exception as e:
+            # No ETag for it, so a resumed run downloads and decodes it again
+            failed_tiles.add(url)
+            logger.warning(f"Could not decode tile {z}/{x}/{y}: {e}")
+            return []
+    # Only recorded once the tile's parcels are in hand
+    if etag: pending_etags[url] = etag
+    return features
+
+################################################################################
+def fetch_parcel_details(region_id, province_id, subdivision_no, parcel_no):
+    try:
+        api_limiter.acquire()
+        url = PARCEL_DETAILS_TMPL.format(
+            region_id=region_id, province_id=province_id,
+            subdivision_no=quote(str(subdivision_no), safe=''), parcel_no=quote(str(parcel_no), safe='')
+        )
+        resp = api_concurrency.get(session, url, timeout=REQUEST_TIMEOUT)
+        if resp.status_code in (404, 410): return None
+        resp.raise_for_status()
+        details = json_loads(resp.content).get("data", {}).get("parcelDetails", [])
+        return details[0] if details else None
+    except Exception:
+        return "ERROR"
+
+################################################################################
+# Long-lived worker pools shared by all chunks and regions, so threads (and their
+# warm connections) are reused instead of being recreated every chunk.
+tile_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS_TILES)
+enrich_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS_ENRICH)
+# Dedicated pool: probes are submitted from enrich workers, sharing their pool could deadlock
+probe_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS_PROBE)
+for _executor in (tile_executor, enrich_executor, probe_executor):
+    atexit.register(_executor.shutdown)
+
+def fetch_parcel_details_multi(region_id, province_ids, subdivision_no, parcel_no):
+    """
+    Looks a parcel up in the candidate provinces PROBE_BATCH at a time, the ones
+    that matched most parcels so far first. Probing all of them at once would cost
+    every province a request under the shared rate cap, where stopping at the
+    first hit costs about half of them.
+    Returns the first match, None if no province has it, or "ERROR" if a probe
+    failed and none matched.
+    """
+    if len(province_ids) == 1:
+        return fetch_parcel_details(region_id, province_ids[0], subdivision_no, parcel_no)
+
+    province_ids = sorted(province_ids, key=lambda p: -province_hits[p])
+    result = None
+    for i in range(0, len(province_ids), PROBE_BATCH):
+        pending = {
+            probe_executor.submit(fetch_parcel_details, region_id, prov_id, subdivision_no, parcel_no)
+            for prov_id in province_ids[i:i + PROBE_BATCH]
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                details = future.result()
+                if details == "ERROR":
+                    result = "ERROR"
+                elif details:
+                    for f in pending: f.cancel() # Drop probes that have not started yet
+                    return details
+    return result
+
+################################################################################
+def submit_tile_batch(executor, tiles, tile_url_template):
+    """Queues tile downloads without waiting, so they overlap with other work"""
+    return [executor.submit(fetch_and_decode_tile, tile, tile_url_template) for tile in tiles]
+
+def process_tile_batch(tile_futures, seen_ids):
+    """
+    Collects the parcels of a tile batch, skipping ids already in seen_ids
+    (parcels on tile edges show up in several tiles). Only the calling thread
+    touches seen_ids, so it needs no lock.
+    """
+    parcels_data = []
+    for future in as_completed(tile_futures):
+        # Features arrive already filtered by decode_tile_features
+        for p in future.result():
+            pid = parcel_key(p['properties'].get('parcel_objectid') or p['properties'].get('parcel_id'))
+            if pid and pid not in seen_ids:
+                seen_ids.add(pid)
+                p['key'] = pid
+                parcels_data.append(p)
+    return parcels_data
+
+################################################################################
+# (region_id, subdivision_no) -> province_id learned from successful lookups.
+# A subdivision belongs to a single province, so later parcels of it skip the probe.
+SUBDIV_CACHE = {}
+province_hits = Counter() # province_id -> parcels found in it, so likely provinces are probed first
+subdiv_cache_lock = threading.Lock()
+
+def lookup_parcel_details(region_id, province_ids, subdivision_no, parcel_no):
+    """Province-probing lookup that tries the province cached for the subdivision first"""
+    cache_key = (region_id, subdivision_no)
+    cached_prov = SUBDIV_CACHE.get(cache_key)
+    if cached_prov is not None:
+        details = fetch_parcel_details(region_id, cached_prov, subdivision_no, parcel_no)
+        if details: return details
+        # Not there after all: fall back to the other provinces
+        province_ids = [p for p in province_ids if p != cached_prov]
+        if not province_ids: return details
+
+    details = fetch_parcel_details_multi(region_id, province_ids, subdivision_no, parcel_no)
+    if details and details != "ERROR" and details.get('provinceId'):
+        with subdiv_cache_lock:
+            SUBDIV_CACHE[cache_key] = details['provinceId']
+            province_hits[details['provinceId']] += 1
+    return details
+
+################################################################################
+def enrich_single_parcel(parcel_data, region_id, province_ids, regions_dict, provinces_dict):
+    props = parcel_data['properties']
+    
+    parcel_obj_id = safe_get(props, 'parcel_objectid', 'parcel_id', 'parcelObjectId')
+    
+    # --- DATA CLEANING START ---
+    raw_parcel_no = safe_get(props, 'parcel_no', 'parcelno', 'parcelNo')
+    parcel_no = clean_parcel_no(raw_parcel_no)
+    
+    # Use smart_get_text to avoid "5555" if a text alternative exists
+    land_use_detailed = smart_get_text(props, 'landuseadetailed', 'land_use_detailed_ar', 'landuse_detailed', 'land_use_detailed')
+    land_use_group = smart_get_text(props, 'landuseagroup', 'land_use_group_ar', 'land_use_group')
+    # --- DATA CLEANING END ---
+
+    subdivision_no = safe_get(props, 'subdivision_no', 'subdivisionno')
+    province_id = safe_get(props, 'province_id', 'provinceid', 'provinceId')
+    
+    neighborhood_id = safe_get(props, 'neighborhood_id', 'neighborhoodid')
+    neighborhood_name = safe_get(props, 'neighborhood_name', 'neighborhaname', 'neighbarhaname', 'neighborh_aname')
+    block_no = safe_get(props, 'block_no', 'blockno') or '---'
+    municipality_name = safe_get(props, 'municipality_aname', 'municipality_name', 'municipalityname')
+    zoning_id = safe_get(props, 'zoning_id', 'zoningid')
+    total_area = safe_get(props, 'shape_area', 'total_area', 'totalarea')
+    
+    details = None
+    enrichment_status = 'TILE_ONLY'
+    
+    # Only try API if we have a CLEAN parcel number
+    if parcel_no and subdivision_no and str(subdivision_no).isdigit():
+        if province_id:
+            details = fetch_parcel_details(region_id, province_id, subdivision_no, parcel_no)
+        elif province_ids:
+            details = lookup_parcel_details(region_id, province_ids, subdivision_no, parcel_no)
+        if details == "ERROR":
+            enrichment_status = 'ERROR'
+            details = None
+        elif details:
+            if details.get('provinceId'):
+                province_id = details.get('provinceId')
+            enrichment_status = 'API_ENRICHED'
+    
+    if not province_id and neighborhood_id:
+        for prov_id in province_ids:
+            prov_info = provinces_dict.get(prov_id, {})
+            if prov_info:
+                province_id = prov_id
+                enrichment_status = 'NEIGHBORHOOD_INFERRED'
+                break
+    
+    if not province_id and province_ids:
+        province_id = province_ids[0]
+        enrichment_status = 'DEFAULT_PROVINCE'
+    
+    geometry = parcel_data.get('geometry')
+    if details:
+        geometry = details.get('geometry') or geometry
+        total_area = details.get('totalArea') or total_area
+    
+    region_info = regions_dict.get(region_id, {})
+    province_info = provinces_dict.get(province_id, {}) if province_id else {}
+    
+    result = {
+        'region_id': region_id,
+        'region_name': region_info.get('name', ''),
+        'province_id': province_id or '',
+        'province_name': province_info.get('name', '') if province_info else '',
+        'parcel_objectid': parcel_obj_id or '',
+        'parcel_no': parcel_no or '', # This is now the cleaned version
+        'subdivision_no': subdivision_no or '',
+        'neighborhood_id': neighborhood_id,
+        'neighborhood_name': neighborhood_name,
+        'block_no': block_no,
+        'total_area': total_area or '',
+        'land_use_detailed': land_use_detailed,
+        'land_use_group': land_use_group,
+        'municipality_name': municipality_name,
+        'zoning_id': zoning_id,
+        'geometry': json_dumps(geometry) if geometry else ''
+    }
+    
+    return result, enrichment_status
+
+################################################################################
+PARCEL_HEADERS = [
+    'region_id', 'region_name', 'province_id', 'province_name',
+    'parcel_objectid', 'parcel_no', 'subdivision_no', 'block_no',
+    'neighborhood_id', 'neighborhood_name', 'total_area',
+    'land_use_detailed', 'land_use_group', 'municipality_name',
+    'zoning_id', 'geometry'
+]
+
+# Output file stays open for the whole run (opened in init_csv_files)
+parcels_fh = None
+parcels_writer = None
+
+def init_csv_files():
+    global parcels_fh, parcels_writer
+    parcels_fh = open(PARCELS_FILE, 'a' if RESUMING else 'w', newline='', encoding='utf-8-sig', buffering=1 << 20)
+    atexit.register(parcels_fh.close)
+    parcels_writer = csv.DictWriter(parcels_fh, fieldnames=PARCEL_HEADERS, extrasaction='ignore')
+    if RESUMING:
+        logger.info(f"Resuming output file: {PARCELS_FILE}")
+    else:
+        # Fresh file: seen ids of every region belong to the old one
+        shutil.rmtree(SEEN_IDS_DIR, ignore_errors=True)
+        parcels_writer.writeheader()
+        logger.info(f"Initialized output file: {PARCELS_FILE}")
+
+################################################################################
+def seen_ids_path(region_id, ext="bin"):
+    return os.path.join(SEEN_IDS_DIR, f"region_{region_id}.{ext}")
+
+def load_seen_ids(region_id):
+    """
+    Ids written for a region by earlier runs: numeric ids as raw int64s in the
+    .bin file, the rare non-numeric ones one per line in the .txt file.
+    Only read when resuming; init_csv_files clears them for a fresh run.
+    """
+    if not RESUMING: return set()
+    seen = set()
+    path = seen_ids_path(region_id)
+    if os.path.exists(path):
+        ids = array('q')
+        with open(path, 'rb') as f:
+            data = f.read()
+        ids.frombytes(data[:len(data) - len(data) % ids.itemsize]) # Drop a torn last record
+        seen.update(ids)
+    path = seen_ids_path(region_id, "txt")
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            seen.update(line.rstrip('\n') for line in f if line.endswith('\n')) # Skip a torn last line
+    return seen
+
+def save_seen_ids(region_id, ids):
+    """Appends a chunk's ids once its rows are flushed to the CSV"""
+    if not ids: return
+    os.makedirs(SEEN_IDS_DIR, exist_ok=True)
+    int_ids = [pid for pid in ids if isinstance(pid, int)]
+    other_ids = [pid for pid in ids if not isinstance(pid, int)]
+    if int_ids:
+        with open(seen_ids_path(region_id), 'ab') as f:
+            array('q', int_ids).tofile(f)
+    if other_ids:
+        with open(seen_ids_path(region_id, "txt"), 'a', encoding='utf-8') as f:
+            f.writelines(f"{pid}\n" for pid in other_ids)
+
+################################################################################
+def plan_region(region_id, regions_dict):
+    """Tiles to scan for a region in scan order, or None if the region can't be scanned"""
+    if region_id not in MAP_NAMES: return None
+    bounds = fetch_region_boundary(region_id, regions_dict)
+    if not bounds: return None
+    
+    tiles = list(mercantile.tiles(*bounds, ZOOM_LEVEL))
+    if not tiles: return None
+    
+    # Sort CENTER-OUT to find data faster
+    min_x, min_y, max_x, max_y = bounds
+    center_x = (min_x + max_x) / 2
+    center_y = (min_y + max_y) / 2
+    center_tile = mercantile.tile(center_x, center_y, ZOOM_LEVEL)
+    
+    # Center-out over 16x16 tile cells, Z-order inside each cell, so a chunk covers
+    # a compact block of neighbouring tiles instead of a thin ring or strip
+    cell_cx, cell_cy = center_tile.x >> 4, center_tile.y >> 4
+    tiles.sort(key=lambda t: (((t.x >> 4) - cell_cx)**2 + ((t.y >> 4) - cell_cy)**2, morton(t.x, t.y)))
+    
+    map_name = MAP_NAMES[region_id]
+    tile_url_template = f"https://tiles.suhail.ai/maps/{map_name}/{{z}}/{{x}}/{{y}}.vector.pbf"
+    return region_id, map_name, tiles, tile_url_template
+
+################################################################################
+def main():
+    logger.section("NON-TRANSACTIONAL PARCEL SCRAPER (OPTIMIZED + CLEANED)")
+    init_csv_files()
+    regions_dict, provinces_dict = fetch_region_metadata()
+    if not regions_dict: return
+    
+    global decode_executor
+    decode_executor = ProcessPoolExecutor()
+    tile_etags.update(load_tile_etags())
+    
+    # Regions are planned lazily; each one's first chunk is queued while the
+    # previous region's last chunk is still enriching, so downloads never stall
+    chunk_size = 200
+    region_plans = (plan for plan in (plan_region(r, regions_dict) for r in REGION_IDS) if plan)
+    plan = next(region_plans, None)
+    if plan:
+        pending_tiles = submit_tile_batch(tile_executor, plan[2][:chunk_size], plan[3])
+    
+    while plan:
+        region_id, map_name, tiles, tile_url_template = plan
+        next_plan = None
+        region_name = regions_dict.get(region_id, {}).get('name', f'ID {region_id}')
+        logger.section(f"REGION {region_id}: {region_name}")
+        logger.info(f"Tiles to Scan: {len(tiles)}")
+        
+        stats = StatsTracker()
+        logger.start_time = time.time()
+        
+        province_ids = [p['id'] for p in regions_dict[region_id].get('provinces', [])]
+        
+        seen_ids = load_seen_ids(region_id)
+        if seen_ids: logger.info(f"Skipping {len(seen_ids)} parcels saved by a previous run")
+        
+        for i in range(0, len(tiles), chunk_size):
+            chunk = tiles[i:i + chunk_size]
+            logger.progress_bar(i, len(tiles), stats.to_dict())
+            
+            # 1. Fetch (next chunk is queued right away so its downloads overlap this chunk's enrichment)
+            # 2. Dedup happens while collecting, so only new parcels come back
+            unique_parcels = process_tile_batch(pending_tiles, seen_ids)
+            if i + chunk_size < len(tiles):
+                pending_tiles = submit_tile_batch(tile_executor, tiles[i + chunk_size:i + 2 * chunk_size], tile_url_template)
+            else:
+                # Last chunk of the region: start on the next region's first chunk
+                next_plan = next(region_plans, None)
+                if next_plan:
+                    pending_tiles = submit_tile_batch(tile_executor, next_plan[2][:chunk_size], next_plan[3])
+            stats.tiles_processed += len(chunk)
+            if unique_parcels: stats.tiles_with_data += 1
+            
+            if not unique_parcels: continue
+            stats.parcels_found += len(unique_parcels)
+
+            # 3. Enrich & Clean
+            futures = [
+                enrich_executor.submit(
+                    enrich_single_parcel, 
+                    p, region_id, province_ids, regions_dict, provinces_dict
+                ) for p in unique_parcels
+            ]
+            
+            for future in as_completed(futures):
+                res, status = future.result()
+                parcels_writer.writerow(res) # Written as it completes, rows aren't held per chunk
+                if 'API_ENRICHED' in status:
+                    stats.parcels_enriched += 1
+                elif 'ERROR' in status:
+                    stats.errors += 1
+            
+            parcels_fh.flush() # Flush per chunk so progress survives a crash
+            save_seen_ids(region_id, [p['key'] for p in unique_parcels])
+        
+        commit_tile_etags(map_name)
+        logger._clear_line()
+        print(f"\nResults for Region {region_id}: Scanned {len(tiles)} | Found {stats.parcels_found} | Enriched {stats.parcels_enriched}")
+        plan = next_plan
+    
+    decode_executor.shutdown()
+
+################################################################################
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.warning("Scraper interrupted.")
+    except Exception as e:
+        logger.error(f"Error: {e}")
\ No newline at end of file
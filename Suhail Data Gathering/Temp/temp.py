@@ -2,13 +2,26 @@
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from urllib.parse import quote
 import csv
+import os
+import sqlite3
 import sys
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from typing import Dict, List, Optional, Set, Tuple
 import time
-from collections import deque
+import random
+import atexit
+from collections import OrderedDict, defaultdict, deque
+try:
+    import orjson # Optional: much faster JSON encoding/decoding
+except ImportError:
+    orjson = None
+try:
+    import httpx # Optional: HTTP/2 for the per-transaction fan-out (pip install "httpx[http2]")
+except ImportError:
+    httpx = None
 #############################################################################################
 
 ###### Configurations ######
@@ -21,33 +34,63 @@ TX_DETAILS_URL = "https://api2.suhail.ai/api/transactions/search"
 PARCEL_URL = "https://api2.suhail.ai/api/parcel/search"
 PRICE_METRICS_URL = "https://api2.suhail.ai/api/parcel/metrics/priceOfMeter"
 
+# Prebuilt query strings for the per-transaction fan-out, so no params dict is
+# built and urlencoded on every call
+TX_DETAILS_TMPL = TX_DETAILS_URL + "?transactionNo={tx_number}&regionId={region_id}"
+PARCEL_TMPL = (PARCEL_URL + "?regionId={region_id}&provinceId={province_id}"
+               "&subdivisionNo={subdivision_no}&parcelNo={parcel_no}&offset=0&limit=10")
+PRICE_METRICS_TMPL = PRICE_METRICS_URL + "?parcelObjsIds={ids}&groupingType=Monthly"
+TRANSACTIONS_TMPL = TRANSACTIONS_URL + "?regionId={region_id}&neighbourhoodId={neighborhood_id}&page={page}&pageSize={page_size}"
+
 # Settings
 REGION_IDS = range(14, 17)
 METRICS_LIMIT = 600
 PAGE_SIZE = 1000
+PAGE_PREFETCH = 4  # Transaction pages requested together once a neighborhood fills a page
 OUTPUT_FILE = "merged_neighborhood_transactions.csv"
 HISTORY_FILE = "parcel_price_history.csv"
+CACHE_DB = "suhail_cache.sqlite"  # Details/geometry fetched by earlier runs
+# SUHAIL_RESUME=1 skips neighborhoods whose rows an earlier run already wrote (tracked in CACHE_DB)
+RESUME = os.environ.get("SUHAIL_RESUME", "") == "1"
+# Without the earlier output file there is nothing to resume into
+RESUMING = RESUME and os.path.exists(OUTPUT_FILE)
+CHECKPOINT_EVERY = 50  # Finished neighborhoods between checkpoints
 TEST = False  # Set to True to test with small sample of data
 
 # Performance settings
 MAX_WORKERS = 6
-BATCH_SIZE = 25
+LISTING_PREFETCH = 4  # Neighborhoods whose transaction lists are fetched ahead of the one being processed
 METRICS_BATCH_SIZE = 20
 REQUEST_TIMEOUT = 15
 CACHE_SIZE_LIMIT = 10000
+FLUSH_EVERY = 5000  # Rows buffered per output file before they are written out
 
 #############################################################################################
+class JitteredRetry(Retry):
+    """
+    Full-jitter backoff: sleeps a random time between 0 and the exponential delay,
+    so worker threads throttled together don't all retry in the same instant.
+    """
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
 def create_session():
     """Create a requests session with retry logic and connection pooling"""
     session = requests.Session()
+    session.headers["Connection"] = "keep-alive"
     
+    # Every endpoint lives on api2.suhail.ai, so one host pool is enough; it just has
+    # to hold a connection per concurrent request or urllib3 discards them
     adapter = HTTPAdapter(
-        pool_connections=20,
-        pool_maxsize=20,
-        max_retries=Retry(
+        pool_connections=1,
+        pool_maxsize=max(MAX_WORKERS * 2, 32),
+        pool_block=False,
+        max_retries=JitteredRetry(
             total=3,
             backoff_factor=0.5,
             status_forcelist=[500, 502, 503, 504, 429],
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
             raise_on_status=False
         )
     )
@@ -58,39 +101,164 @@ def create_session():
 
 session = create_session()
 
+class StatusRetryClient:
+    """
+    httpx's transport only retries failed connections. This adds what the requests
+    session gets from JitteredRetry: 429 and 5xx responses are retried with full-jitter
+    backoff (or after Retry-After when the server sends one), and redirects are followed.
+    """
+    STATUS_FORCELIST = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, client, total, backoff_factor):
+        self.client = client
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.retry = JitteredRetry(total=total, backoff_factor=backoff_factor) # Retry-After parsing
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("follow_redirects", True)
+        for attempt in range(self.total + 1):
+            resp = self.client.get(url, **kwargs)
+            if resp.status_code not in self.STATUS_FORCELIST or attempt == self.total:
+                return resp
+            retry_after = resp.headers.get("Retry-After")
+            try:
+                delay = self.retry.parse_retry_after(retry_after) if retry_after else None
+            except Exception: # Malformed header: fall back to backoff
+                delay = None
+            if delay is None:
+                delay = random.uniform(0, self.backoff_factor * (2 ** attempt))
+            resp.close()
+            time.sleep(delay)
+
+    def close(self):
+        self.client.close()
+
+def create_fanout_client():
+    """
+    Details, geometry and price history are many small GETs to one host: with
+    httpx[http2] installed they are multiplexed over a few HTTP/2 connections.
+    Falls back to the pooled requests session otherwise.
+    """
+    if httpx:
+        try:
+            # Limits belong on the transport: the Client ignores its own once a transport is given
+            client = httpx.Client(transport=httpx.HTTPTransport(
+                http2=True, retries=3,
+                limits=httpx.Limits(max_connections=MAX_WORKERS, max_keepalive_connections=MAX_WORKERS)
+            ))
+            return StatusRetryClient(client, total=3, backoff_factor=0.5)
+        except ImportError: # httpx without the h2 extra
+            pass
+    return session
+
+fanout_client = create_fanout_client()
+atexit.register(fanout_client.close)
+
+# One worker pool for the whole run instead of a new one per batch call
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+atexit.register(executor.shutdown)
+# Transaction listings get their own threads so they never queue behind detail requests
+listing_executor = ThreadPoolExecutor(max_workers=LISTING_PREFETCH)
+atexit.register(listing_executor.shutdown)
+# Single thread that fetches the next metrics (neighborhood list) page during the current one
+metrics_executor = ThreadPoolExecutor(max_workers=1)
+atexit.register(metrics_executor.shutdown)
+
 #############################################################################################
 # Caching & State
 class LimitedCache:
-    """Simple LRU-like cache with size limit"""
+    """LRU cache with size limit (OrderedDict keeps recency order, all operations O(1))"""
     def __init__(self, max_size=1000):
-        self.cache = {}
-        self.access_order = deque()
+        self.cache = OrderedDict()
         self.max_size = max_size
     
     def get(self, key, default=None):
-        return self.cache.get(key, default)
+        try:
+            self.cache.move_to_end(key)
+        except KeyError:
+            return default
+        return self.cache[key]
     
     def set(self, key, value):
-        if key not in self.cache and len(self.cache) >= self.max_size:
-            if self.access_order:
-                old_key = self.access_order.popleft()
-                self.cache.pop(old_key, None)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        elif len(self.cache) >= self.max_size:
+            self.cache.popitem(last=False)
         self.cache[key] = value
-        if key in self.access_order:
-            self.access_order.remove(key)
-        self.access_order.append(key)
     
     def __contains__(self, key):
         return key in self.cache
 
-transaction_details_cache = LimitedCache(max_size=CACHE_SIZE_LIMIT)
-parcel_geometry_cache = LimitedCache(max_size=CACHE_SIZE_LIMIT)
-seen_transactions: Set[Tuple] = set()
+# Cache miss marker, so a single get() tells a miss apart from a cached None/{}
+MISSING = object()
+
+class PersistentCache(LimitedCache):
+    """
+    LimitedCache backed by a SQLite table, so results fetched by earlier runs are
+    reused after a restart. In-memory misses fall through to the table. Only
+    non-empty values are persisted, so failed or empty lookups are retried next run.
+    Keys and values are stored as JSON. Only used from the main thread.
+    """
+    COMMIT_EVERY = 500
+
+    def __init__(self, db, table, max_size=1000):
+        super().__init__(max_size)
+        self.db = db
+        self.table = table
+        self.uncommitted = 0
+        db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT)")
+
+    def get(self, key, default=None):
+        value = super().get(key, MISSING)
+        if value is not MISSING:
+            return value
+        row = self.db.execute(f"SELECT value FROM {self.table} WHERE key = ?", (json_dumps(key),)).fetchone()
+        if row is None:
+            return default
+        value = json_loads(row[0])
+        super().set(key, value)
+        return value
+
+    def set(self, key, value):
+        super().set(key, value)
+        if not value: return
+        self.db.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)", (json_dumps(key), json_dumps(value)))
+        self.uncommitted += 1
+        if self.uncommitted >= self.COMMIT_EVERY:
+            self.db.commit()
+            self.uncommitted = 0
+
+cache_db = sqlite3.connect(CACHE_DB)
+atexit.register(cache_db.close)
+atexit.register(cache_db.commit) # Runs before close
+
+transaction_details_cache = PersistentCache(cache_db, "transaction_details", max_size=CACHE_SIZE_LIMIT)
+parcel_geometry_cache = PersistentCache(cache_db, "parcel_geometry", max_size=CACHE_SIZE_LIMIT)
+
+#############################################################################################
+# JSON Helpers
+def json_loads(content):
+    """Parses a raw response body (orjson when available)"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def json_dumps(obj):
+    """Compact UTF-8 JSON string, same output with or without orjson"""
+    if orjson:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
 
 #############################################################################################
 # Logging Helpers
+PROGRESS_INTERVAL = 0.25  # Seconds between redraws of the progress line
+last_progress = 0.0
+
 def log_progress(msg):
-    """Print clean progress message overwriting current line"""
+    """Print clean progress message overwriting current line (skipped if the last one was too recent)"""
+    global last_progress
+    now = time.monotonic()
+    if now - last_progress < PROGRESS_INTERVAL: return
+    last_progress = now
     sys.stdout.write(f"\r{msg.ljust(100)}")
     sys.stdout.flush()
 
@@ -140,41 +308,31 @@ def needs_geometry_fetch(tx, details, centroid_x):
 
 #############################################################################################
 def fetch_transaction_details(region_id: int, tx_number: str) -> dict:
-    try:
-        resp = session.get(
-            TX_DETAILS_URL,
-            params={"transactionNo": tx_number, "regionId": region_id},
-            timeout=REQUEST_TIMEOUT
-        )
-        resp.raise_for_status()
-        data = resp.json().get("data", [])
-        return data[0] if data else {}
-    except Exception:
-        return {}
+    """Raises on failure, so batch_fetch_details can keep errors out of the cache"""
+    resp = fanout_client.get(
+        TX_DETAILS_TMPL.format(tx_number=quote(str(tx_number), safe=""), region_id=region_id),
+        timeout=REQUEST_TIMEOUT
+    )
+    resp.raise_for_status()
+    data = json_loads(resp.content).get("data", [])
+    return data[0] if data else {}
 
 #############################################################################################
 def fetch_parcel_geometry(region_id: int, province_id: int, subdivision_no: str, parcel_no: str) -> Optional[dict]:
+    """None when the parcel has no geometry; raises on failure so it isn't cached"""
     if not is_valid_subdivision(subdivision_no):
         return None
-    try:
-        resp = session.get(
-            PARCEL_URL,
-            params={
-                "regionId": region_id,
-                "provinceId": province_id,
-                "subdivisionNo": subdivision_no,
-                "parcelNo": parcel_no,
-                "offset": 0,
-                "limit": 10
-            },
-            timeout=REQUEST_TIMEOUT
-        )
-        if resp.status_code in (404, 410): return None
-        resp.raise_for_status()
-        details = resp.json().get("data", {}).get("parcelDetails", [])
-        return details[0].get("geometry") if details else None
-    except Exception:
-        return None
+    resp = fanout_client.get(
+        PARCEL_TMPL.format(
+            region_id=region_id, province_id=province_id,
+            subdivision_no=quote(str(subdivision_no), safe=""), parcel_no=quote(str(parcel_no), safe="")
+        ),
+        timeout=REQUEST_TIMEOUT
+    )
+    if resp.status_code in (404, 410): return None
+    resp.raise_for_status()
+    details = json_loads(resp.content).get("data", {}).get("parcelDetails", [])
+    return details[0].get("geometry") if details else None
 
 #############################################################################################
 def fetch_price_metrics_batch(parcel_ids: List[int]) -> List[dict]:
@@ -186,16 +344,12 @@ def fetch_price_metrics_batch(parcel_ids: List[int]) -> List[dict]:
     ids_str = ",".join(map(str, parcel_ids))
     
     try:
-        resp = session.get(
-            PRICE_METRICS_URL,
-            params={
-                "parcelObjsIds": ids_str,
-                "groupingType": "Monthly"
-            },
+        resp = fanout_client.get(
+            PRICE_METRICS_TMPL.format(ids=quote(ids_str, safe="")),
             timeout=REQUEST_TIMEOUT
         )
         resp.raise_for_status()
-        return resp.json().get("data", [])
+        return json_loads(resp.content).get("data", [])
     except Exception as e:
         # Silently fail for metrics to not stop the scraper
         return []
@@ -203,36 +357,37 @@ def fetch_price_metrics_batch(parcel_ids: List[int]) -> List[dict]:
 #############################################################################################
 def batch_fetch_details(region_id: int, tx_list: List[dict]) -> Dict[str, dict]:
     results = {}
-    to_fetch = []
+    to_fetch: Set[str] = set() # A number listed twice is still requested once
     
     for tx in tx_list:
         tx_number = tx.get("transactionNumber")
-        if tx_number in transaction_details_cache:
-            results[tx_number] = transaction_details_cache.get(tx_number)
+        cached = transaction_details_cache.get(tx_number, MISSING)
+        if cached is not MISSING:
+            results[tx_number] = cached
         else:
-            to_fetch.append(tx_number)
+            to_fetch.add(tx_number)
     
     if not to_fetch:
         return results
     
     log_progress(f"   Fetching details for {len(to_fetch)} items...")
     
-    for i in range(0, len(to_fetch), BATCH_SIZE):
-        batch = to_fetch[i:i + BATCH_SIZE]
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_tx = {
-                executor.submit(fetch_transaction_details, region_id, tx_num): tx_num 
-                for tx_num in batch
-            }
-            for future in as_completed(future_to_tx):
-                tx_number = future_to_tx[future]
-                try:
-                    details = future.result()
-                    transaction_details_cache.set(tx_number, details)
-                    results[tx_number] = details
-                except Exception:
-                    transaction_details_cache.set(tx_number, {})
-                    results[tx_number] = {}
+    # Everything is submitted at once: workers pick up the next request as soon as
+    # they are free instead of waiting for the slowest request of each batch
+    future_to_tx = {
+        executor.submit(fetch_transaction_details, region_id, tx_num): tx_num 
+        for tx_num in to_fetch
+    }
+    # Results only go into dicts, so wait for the whole batch once instead of waking per future
+    done, _ = wait(future_to_tx)
+    for future in done:
+        tx_number = future_to_tx[future]
+        try:
+            details = future.result()
+            transaction_details_cache.set(tx_number, details)
+            results[tx_number] = details
+        except Exception:
+            results[tx_number] = {} # Not cached: a later run requests it again
     return results
 
 #############################################################################################
@@ -241,8 +396,9 @@ def batch_fetch_geometries(requests_list: List[Tuple]) -> Dict[Tuple, Optional[d
     to_fetch = []
     
     for req in requests_list:
-        if req in parcel_geometry_cache:
-            results[req] = parcel_geometry_cache.get(req)
+        cached = parcel_geometry_cache.get(req, MISSING)
+        if cached is not MISSING:
+            results[req] = cached
         else:
             to_fetch.append(req)
     
@@ -251,26 +407,27 @@ def batch_fetch_geometries(requests_list: List[Tuple]) -> Dict[Tuple, Optional[d
     
     log_progress(f"   Fetching geometry for {len(to_fetch)} parcels...")
     
-    for i in range(0, len(to_fetch), BATCH_SIZE):
-        batch = to_fetch[i:i + BATCH_SIZE]
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_req = {
-                executor.submit(fetch_parcel_geometry, *req): req 
-                for req in batch
-            }
-            for future in as_completed(future_to_req):
-                req = future_to_req[future]
-                try:
-                    results[req] = future.result()
-                    parcel_geometry_cache.set(req, results[req])
-                except Exception:
-                    results[req] = None
-                    parcel_geometry_cache.set(req, None)
+    future_to_req = {
+        executor.submit(fetch_parcel_geometry, *req): req 
+        for req in to_fetch
+    }
+    done, _ = wait(future_to_req)
+    for future in done:
+        req = future_to_req[future]
+        try:
+            results[req] = future.result()
+            parcel_geometry_cache.set(req, results[req])
+        except Exception:
+            results[req] = None # Not cached: a later run requests it again
     return results
 
 #############################################################################################
-def batch_process_metrics(transactions: List[dict]):
-    """Process price metrics for a list of transactions"""
+def submit_price_metrics(transactions: List[dict]):
+    """
+    Queues the price history requests for a list of transactions on the shared
+    executor, so they run while details and geometry are being fetched.
+    Returns (id_map, futures) for save_price_metrics.
+    """
     # Extract IDs (using 'parcelObjectId' field from transaction object)
     # We only care about transactions that have an ID
     id_map = {} # map parcelObjId -> transactionNumber (for reference)
@@ -284,16 +441,24 @@ def batch_process_metrics(transactions: List[dict]):
             id_map[t_id] = t_num
 
     if not ids_to_fetch:
-        return
+        return id_map, []
 
     log_progress(f"   Fetching price history for {len(ids_to_fetch)} parcels...")
     
+    # Process in batches
+    futures = [
+        executor.submit(fetch_price_metrics_batch, ids_to_fetch[i:i + METRICS_BATCH_SIZE])
+        for i in range(0, len(ids_to_fetch), METRICS_BATCH_SIZE)
+    ]
+    return id_map, futures
+
+#############################################################################################
+def save_price_metrics(id_map, futures):
+    """Collects the price history queued by submit_price_metrics and appends it to HISTORY_FILE"""
     all_metrics_rows = []
     
-    # Process in batches
-    for i in range(0, len(ids_to_fetch), METRICS_BATCH_SIZE):
-        batch = ids_to_fetch[i:i + METRICS_BATCH_SIZE]
-        metrics_data = fetch_price_metrics_batch(batch)
+    for future in futures:
+        metrics_data = future.result()
         
         for item in metrics_data:
             parcel_obj_id = item.get("parcelObjId")
@@ -301,111 +466,173 @@ def batch_process_metrics(transactions: List[dict]):
             
             # 1. Parcel Metrics (Specific to this land)
             for pm in item.get("parcelMetrics", []):
-                all_metrics_rows.append({
-                    "parcelObjId": parcel_obj_id,
-                    "transactionNumber": id_map.get(parcel_obj_id, ""),
-                    "neighborhoodId": neighborhood_id,
-                    "type": "Parcel Specific",
-                    "month": pm.get("month"),
-                    "year": pm.get("year"),
-                    "metricsType": pm.get("metricsType"),
-                    "averagePriceOfMeter": pm.get("avaragePriceOfMeter")
-                })
+                all_metrics_rows.append((
+                    parcel_obj_id, id_map.get(parcel_obj_id, ""), neighborhood_id, "Parcel Specific",
+                    pm.get("month"), pm.get("year"), pm.get("metricsType"), pm.get("avaragePriceOfMeter")
+                ))
                 
             # 2. Neighborhood Metrics (General area averages)
             for nm in item.get("neighborhoodMetrics", []):
-                all_metrics_rows.append({
-                    "parcelObjId": parcel_obj_id,
-                    "transactionNumber": id_map.get(parcel_obj_id, ""),
-                    "neighborhoodId": nm.get("neighborhoodId"),
-                    "type": "Neighborhood Average",
-                    "month": nm.get("month"),
-                    "year": nm.get("year"),
-                    "metricsType": nm.get("metricsType"),
-                    "averagePriceOfMeter": nm.get("avaragePriceOfMeter")
-                })
+                all_metrics_rows.append((
+                    parcel_obj_id, id_map.get(parcel_obj_id, ""), nm.get("neighborhoodId"), "Neighborhood Average",
+                    nm.get("month"), nm.get("year"), nm.get("metricsType"), nm.get("avaragePriceOfMeter")
+                ))
 
     append_history_to_csv(all_metrics_rows)
 
 #############################################################################################
+# Output files stay open in append mode for the whole run: filename -> (file, csv.writer).
+# Rows are tuples already in the file's column order, so the C csv.writer formats them directly.
+csv_writers: Dict[str, Tuple] = {}
+
+def write_rows(filename, fieldnames, rows):
+    """Opens the file on first use (header only if it's missing or empty) and writes rows to it"""
+    if filename not in csv_writers:
+        is_empty = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        f = open(filename, "a", newline="", encoding="utf-8-sig", buffering=1 << 20)
+        writer = csv.writer(f)
+        if is_empty: writer.writerow(fieldnames)
+        csv_writers[filename] = (f, writer)
+    _, writer = csv_writers[filename]
+    writer.writerows(rows)
+
+def close_csv_writers():
+    for f, _ in csv_writers.values():
+        f.close()
+
+atexit.register(close_csv_writers)
+
+# Rows are accumulated across neighborhoods and written in FLUSH_EVERY sized
+# batches: filename -> (fieldnames, pending rows)
+row_buffers: Dict[str, Tuple] = {}
+
+def buffer_rows(filename, fieldnames, rows):
+    fieldnames, pending = row_buffers.setdefault(filename, (list(fieldnames), []))
+    pending.extend(rows)
+    if len(pending) >= FLUSH_EVERY:
+        write_rows(filename, fieldnames, pending)
+        pending.clear()
+
+def flush_row_buffers():
+    for filename, (fieldnames, pending) in row_buffers.items():
+        if pending:
+            write_rows(filename, fieldnames, pending)
+            pending.clear()
+
+atexit.register(flush_row_buffers) # Registered last so it runs before close_csv_writers
+
+# Resume state: neighborhoods whose rows are known to be in the output files
+# Keyed by OUTPUT_FILE: the scrapers share CACHE_DB, but each has its own checkpoints
+cache_db.execute("CREATE TABLE IF NOT EXISTS finished_neighborhoods (output_file TEXT, region_id INTEGER, neighborhood_id INTEGER, PRIMARY KEY (output_file, region_id, neighborhood_id))")
+if not RESUMING: cache_db.execute("DELETE FROM finished_neighborhoods WHERE output_file = ?", (OUTPUT_FILE,))
+cache_db.commit()
+done_neighborhoods = set(cache_db.execute("SELECT region_id, neighborhood_id FROM finished_neighborhoods WHERE output_file = ?", (OUTPUT_FILE,)))
+pending_done = [] # Finished since the last checkpoint
+
+def mark_neighborhood_done(region_id, neighborhood_id):
+    pending_done.append((OUTPUT_FILE, region_id, neighborhood_id))
+    if len(pending_done) >= CHECKPOINT_EVERY:
+        checkpoint()
+
+def checkpoint():
+    """
+    Writes out the buffered rows and only then records the neighborhoods finished since the
+    last checkpoint, so a resumed run never skips a neighborhood whose rows were still buffered.
+    """
+    flush_row_buffers()
+    for f, _ in csv_writers.values():
+        f.flush()
+    if not pending_done: return
+    cache_db.executemany("INSERT OR IGNORE INTO finished_neighborhoods VALUES (?, ?, ?)", pending_done)
+    cache_db.commit()
+    pending_done.clear()
+
+atexit.register(checkpoint) # Runs before the buffers are flushed and the files closed
+
+#############################################################################################
+OUTPUT_FIELDNAMES = [
+    "regionId", "region_name", "region_centroid_x", "region_centroid_y",
+    "boundary_sw_x", "boundary_sw_y", "boundary_ne_x", "boundary_ne_y",
+    "region_image", "province_id", "provinceName", "province_centroid_x",
+    "province_centroid_y", "neighborhoodId", "neighborhoodName", "رقم الصفقة",
+    "رقم المخطط", "رقم البلوك", "رقم القطعة", "قيمة الصفقة (ï·¼)",
+    "سعر المتر (ï·¼)", "تاريخ الصفقة", "نوع الأرض", "نوع الاستخدام",
+    "المساحة الإجمالية", "المصدر", "sellingType", "landUseGroup",
+    "propertyType", "centroidX", "centroidY", "parcelObjId",
+    "polygonData", "geometry",
+]
+
 def append_to_csv(new_rows):
     if not new_rows: return
-    try:
-        with open(OUTPUT_FILE, 'r', encoding="utf-8-sig"): file_exists = True
-    except FileNotFoundError: file_exists = False
-    
-    with open(OUTPUT_FILE, "a", newline="", encoding="utf-8-sig") as f:
-        writer = csv.DictWriter(f, fieldnames=new_rows[0].keys())
-        if not file_exists: writer.writeheader()
-        writer.writerows(new_rows)
+    buffer_rows(OUTPUT_FILE, OUTPUT_FIELDNAMES, new_rows)
 
 #############################################################################################
+HISTORY_FIELDNAMES = ["parcelObjId", "transactionNumber", "neighborhoodId", "type", "month", "year", "metricsType", "averagePriceOfMeter"]
+
 def append_history_to_csv(new_rows):
     """Append price history metrics to separate CSV"""
     if not new_rows: return
-    
-    try:
-        with open(HISTORY_FILE, 'r', encoding="utf-8-sig"): file_exists = True
-    except FileNotFoundError: file_exists = False
-    
-    fieldnames = ["parcelObjId", "transactionNumber", "neighborhoodId", "type", "month", "year", "metricsType", "averagePriceOfMeter"]
-    
-    with open(HISTORY_FILE, "a", newline="", encoding="utf-8-sig") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists: writer.writeheader()
-        writer.writerows(new_rows)
+    buffer_rows(HISTORY_FILE, HISTORY_FIELDNAMES, new_rows)
 
 #############################################################################################
-def build_row(region_id, province_id, province_name, neighborhood_id, neighborhood_name, tx, details, geometry=None, region_dict=None, province_dict=None):
-    tx_number = tx.get("transactionNumber")
-    centroid_x, centroid_y = extract_coordinates(tx, details)
+def build_row(region_id, province_id, province_name, neighborhood_id, neighborhood_name, tx, details, geometry=None, region_dict=None, province_dict=None, coordinates=None):
+    """Output row as a tuple in OUTPUT_FIELDNAMES order. coordinates: extract_coordinates() result if already known"""
+    # Bound once: the getters are called ~30 times per row
+    t = tx.get
+    d = details.get if details else (lambda key: "")
+    centroid_x, centroid_y = coordinates or extract_coordinates(tx, details)
     
     region_data = region_dict.get(region_id, {})
+    region_centroid = region_data.get("centroid", {})
     boundary = region_data.get("restrictBoundaryBox", {})
-    
-    row = {
-        "regionId": region_id,
-        "region_name": region_data.get("name", ""),
-        "region_centroid_x": region_data.get("centroid", {}).get("x", ""),
-        "region_centroid_y": region_data.get("centroid", {}).get("y", ""),
-        "boundary_sw_x": boundary.get("southwest", {}).get("x", ""),
-        "boundary_sw_y": boundary.get("southwest", {}).get("y", ""),
-        "boundary_ne_x": boundary.get("northeast", {}).get("x", ""),
-        "boundary_ne_y": boundary.get("northeast", {}).get("y", ""),
-        "region_image": region_data.get("image", ""),
-        "province_id": province_id or "",
-        "provinceName": province_name or "",
-        "province_centroid_x": province_dict.get(province_id, {}).get("centroid", {}).get("x", ""),
-        "province_centroid_y": province_dict.get(province_id, {}).get("centroid", {}).get("y", ""),
-        "neighborhoodId": neighborhood_id,
-        "neighborhoodName": neighborhood_name,
-        "رقم الصفقة": tx_number or "",
-        "رقم المخطط": tx.get("subdivisionNo") or "",
-        "رقم البلوك": tx.get("blockNo") or "---",
-        "رقم القطعة": tx.get("parcelNo") or "",
-        "قيمة الصفقة (ï·¼)": tx.get("transactionPrice") or "",
-        "سعر المتر (ï·¼)": tx.get("priceOfMeter") or "",
-        "تاريخ الصفقة": tx.get("transactionDate") or "",
-        "نوع الأرض": details.get("type") if details else "",
-        "نوع الاستخدام": details.get("metricsType") if details else "",
-        "المساحة الإجمالية": details.get("totalArea") if details else "",
-        "المصدر": details.get("transactionSource") if details else "",
-        "sellingType": details.get("sellingType") if details else "",
-        "landUseGroup": details.get("landUseGroup") if details else "",
-        "propertyType": details.get("propertyType") if details else "",
-        "centroidX": centroid_x or "",
-        "centroidY": centroid_y or "",
-        "parcelObjId": tx.get("parcelObjectId", ""), # Added this to link with history file
-        "polygonData": json.dumps(details.get("polygonData"), ensure_ascii=False) if details and details.get("polygonData") else "",
-        "geometry": json.dumps((details.get("geometry") if details else None) or geometry, ensure_ascii=False) if (details and details.get("geometry")) or geometry else ""
-    }
-    return row
+    southwest = boundary.get("southwest", {})
+    northeast = boundary.get("northeast", {})
+    province_centroid = province_dict.get(province_id, {}).get("centroid", {})
+    polygon_data = d("polygonData")
+    geometry = d("geometry") or geometry
+    
+    return (
+        region_id,
+        region_data.get("name", ""),
+        region_centroid.get("x", ""),
+        region_centroid.get("y", ""),
+        southwest.get("x", ""),
+        southwest.get("y", ""),
+        northeast.get("x", ""),
+        northeast.get("y", ""),
+        region_data.get("image", ""),
+        province_id or "",
+        province_name or "",
+        province_centroid.get("x", ""),
+        province_centroid.get("y", ""),
+        neighborhood_id,
+        neighborhood_name,
+        t("transactionNumber") or "",
+        t("subdivisionNo") or "",
+        t("blockNo") or "---",
+        t("parcelNo") or "",
+        t("transactionPrice") or "",
+        t("priceOfMeter") or "",
+        t("transactionDate") or "",
+        d("type"),
+        d("metricsType"),
+        d("totalArea"),
+        d("transactionSource"),
+        d("sellingType"),
+        d("landUseGroup"),
+        d("propertyType"),
+        centroid_x or "",
+        centroid_y or "",
+        t("parcelObjectId", ""), # Added this to link with history file
+        json_dumps(polygon_data) if polygon_data else "",
+        json_dumps(geometry) if geometry else "",
+    )
 
 #############################################################################################
 def fetch_regions():
     response = session.get(REGIONS_URL)
     response.raise_for_status()
-    regions = response.json()["data"]
+    regions = json_loads(response.content)["data"]
     r_dict, p_dict = {}, {}
     for r in regions:
         r_dict[r["id"]] = r
@@ -413,97 +640,159 @@ def fetch_regions():
             p_dict[p["id"]] = p
     return r_dict, p_dict
 
+#############################################################################################
+def fetch_transactions_page(region_id, neighborhood_id, page):
+    tx_resp = fanout_client.get(
+        TRANSACTIONS_TMPL.format(region_id=region_id, neighborhood_id=neighborhood_id, page=page, page_size=PAGE_SIZE),
+        timeout=30
+    )
+    tx_resp.raise_for_status()
+    return json_loads(tx_resp.content).get("data", [])
+
+def fetch_neighborhood_transactions(region_id, neighborhood_id):
+    """
+    All transaction pages of a neighborhood, up to the first empty (or short) page.
+    Once a page comes back full, the next PAGE_PREFETCH pages are requested together
+    on the shared executor and the first short one among them is the last page.
+    Returns (transactions, complete); complete is False if a page failed to load.
+    """
+    all_transactions = []
+    page = 0
+    window = 1
+    while True:
+        futures = [
+            executor.submit(fetch_transactions_page, region_id, neighborhood_id, p)
+            for p in range(page, page + window)
+        ]
+        done = False
+        for future in futures:
+            try:
+                txs = future.result()
+            except Exception:
+                for f in futures: f.cancel()
+                return all_transactions, False
+            if not txs:
+                done = True
+                break
+            all_transactions.extend(txs)
+            if window > 1 and len(txs) < PAGE_SIZE:
+                done = True
+                break
+        for f in futures: f.cancel() # Pages past the end that haven't started yet
+        if done or TEST: break
+        page += window
+        window = PAGE_PREFETCH if len(txs) >= PAGE_SIZE else 1
+    return all_transactions, True
+
+def prefetch_listings(region_id, items):
+    """
+    Yields (item, (transactions, complete)) in order. The listings of the next LISTING_PREFETCH
+    neighborhoods are fetched in the background while the current one is processed;
+    everything else (caches, CSV) stays on the main thread.
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, listing_executor.submit(fetch_neighborhood_transactions, region_id, item["neighborhoodId"])))
+        if len(pending) > LISTING_PREFETCH:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+#############################################################################################
+def fetch_metrics_page(region_id, offset):
+    metrics_resp = session.get(METRICS_URL, params={"regionId": region_id, "offset": offset, "limit": METRICS_LIMIT}, timeout=30)
+    metrics_resp.raise_for_status()
+    return json_loads(metrics_resp.content).get("data", {}).get("items", [])
+
 #############################################################################################
 def process_region(region_id, region_dict, province_dict):
     log_info(f">> Starting Region {region_id}: {region_dict.get(region_id, {}).get('name', 'Unknown')}")
     region_rows = 0
     offset = 0
-    
+    next_page = metrics_executor.submit(fetch_metrics_page, region_id, offset)
     while True:
         # Fetch Neighborhoods (Metrics)
         try:
-            metrics_resp = session.get(METRICS_URL, params={"regionId": region_id, "offset": offset, "limit": METRICS_LIMIT}, timeout=30)
-            metrics_resp.raise_for_status()
+            items = next_page.result()
         except Exception as e:
             log_info(f"Error fetching metrics list: {e}")
             break
 
-        items = metrics_resp.json().get("data", {}).get("items", [])
         if not items: break
 
+        # The following page is fetched while this one's neighborhoods are processed
+        offset += METRICS_LIMIT
+        if not TEST: next_page = metrics_executor.submit(fetch_metrics_page, region_id, offset)
+
         if TEST: items = items[:3]
+        if RESUMING:
+            items = [item for item in items if (region_id, item["neighborhoodId"]) not in done_neighborhoods]
 
-        for idx, item in enumerate(items, 1):
+        # Transactions arrive already fetched for the next LISTING_PREFETCH neighborhoods
+        for idx, (item, (all_transactions, complete)) in enumerate(prefetch_listings(region_id, items), 1):
             neighborhood_id = item["neighborhoodId"]
             neighborhood_name = item["neighborhoodName"]
             log_progress(f"   Processing Neighborhood {idx}/{len(items)}: {neighborhood_name} (ID: {neighborhood_id})")
 
-            # Fetch Transactions
-            all_transactions = []
-            page = 0
-            while True:
-                try:
-                    tx_resp = session.get(
-                        TRANSACTIONS_URL,
-                        params={"regionId": region_id, "neighbourhoodId": neighborhood_id, "page": page, "pageSize": PAGE_SIZE},
-                        timeout=30
-                    )
-                    tx_resp.raise_for_status()
-                    txs = tx_resp.json().get("data", [])
-                    if not txs: break
-                    all_transactions.extend(txs)
-                    page += 1
-                    if TEST and page >= 1: break
-                except Exception:
-                    break
-            
-            if not all_transactions: continue
+            if not complete:
+                # Nothing written or checkpointed, so a resumed run fetches it again from scratch
+                log_info(f"Error fetching transactions of {neighborhood_name} ({neighborhood_id}), skipped")
+                continue
+
+            if not all_transactions:
+                mark_neighborhood_done(region_id, neighborhood_id)
+                continue
 
             # Filter Duplicates
+            # Duplicates only come from overlapping pages of this neighborhood's listing,
+            # so the seen set lives for this neighborhood only
             new_transactions = []
+            seen = set()
             for tx in all_transactions:
-                key = (region_id, neighborhood_id, tx.get("transactionNumber"))
-                if key not in seen_transactions:
-                    seen_transactions.add(key)
+                tx_number = tx.get("transactionNumber")
+                if tx_number not in seen:
+                    seen.add(tx_number)
                     new_transactions.append(tx)
             
-            if not new_transactions: continue
+            if not new_transactions:
+                mark_neighborhood_done(region_id, neighborhood_id)
+                continue
+
+            # Price history only needs the transaction list: start it now so it overlaps steps 1-3
+            metrics_job = submit_price_metrics(new_transactions)
 
             # 1. Fetch Details
             tx_needing_details = [tx for tx in new_transactions if needs_details_fetch(tx)]
             details_map = batch_fetch_details(region_id, tx_needing_details) if tx_needing_details else {}
             
             # 2. Prepare Details Map for all
+            # Transactions that already carry the detail fields are their own details
+            # (same key names), so they're used as-is instead of copied into a new dict
             for tx in new_transactions:
                 if tx.get("transactionNumber") not in details_map:
-                    details_map[tx.get("transactionNumber")] = {
-                        "type": tx.get("type"), "metricsType": tx.get("metricsType"),
-                        "totalArea": tx.get("totalArea"), "transactionSource": tx.get("transactionSource"),
-                        "sellingType": tx.get("sellingType"), "landUseGroup": tx.get("landUseGroup"),
-                        "propertyType": tx.get("propertyType"), "centroidX": tx.get("centroidX"),
-                        "centroidY": tx.get("centroidY"), "geometry": tx.get("geometry"),
-                        "polygonData": tx.get("polygonData"), "provinceId": tx.get("provinceId")
-                    }
+                    details_map[tx.get("transactionNumber")] = tx
 
             # 3. Fetch Geometries
-            geo_reqs = []
+            # Parcel request -> transactions wanting it, so each parcel is requested once
+            req_to_txs = defaultdict(list)
+            coords_map = {} # Reused by build_row below
             for tx in new_transactions:
                 details = details_map.get(tx.get("transactionNumber"), {})
-                cx, _ = extract_coordinates(tx, details)
-                if needs_geometry_fetch(tx, details, cx):
+                coords_map[tx.get("transactionNumber")] = coords = extract_coordinates(tx, details)
+                if needs_geometry_fetch(tx, details, coords[0]):
                     prov_id = details.get("provinceId") or item.get("provinceId")
                     if tx.get("parcelNo") and tx.get("subdivisionNo") and prov_id:
-                        geo_reqs.append(((region_id, prov_id, tx.get("subdivisionNo"), tx.get("parcelNo")), tx.get("transactionNumber")))
+                        req_to_txs[(region_id, prov_id, tx.get("subdivisionNo"), tx.get("parcelNo"))].append(tx.get("transactionNumber"))
             
             geo_map = {}
-            if geo_reqs:
-                unique_reqs = list(set([r for r, _ in geo_reqs]))
-                geo_results = batch_fetch_geometries(unique_reqs)
-                for req, tnum in geo_reqs:
-                    geo_map[tnum] = geo_results.get(req)
+            if req_to_txs:
+                geo_results = batch_fetch_geometries(list(req_to_txs))
+                geo_map = {tnum: geo_results.get(req) for req, tnums in req_to_txs.items() for tnum in tnums}
 
-            # 4. Fetch Price History Metrics (NEW STEP)
-            batch_process_metrics(new_transactions)
+            # 4. Collect Price History Metrics (NEW STEP)
+            save_price_metrics(*metrics_job)
 
             # 5. Build & Save Rows
             rows_to_save = []
@@ -515,13 +804,13 @@ def process_region(region_id, region_dict, province_dict):
                 
                 rows_to_save.append(build_row(
                     region_id, prov_id, item.get("provinceName"), neighborhood_id, 
-                    neighborhood_name, tx, details, geom, region_dict, province_dict
+                    neighborhood_name, tx, details, geom, region_dict, province_dict, coords_map.get(tnum)
                 ))
             
             append_to_csv(rows_to_save)
             region_rows += len(rows_to_save)
+            mark_neighborhood_done(region_id, neighborhood_id)
 
-        offset += METRICS_LIMIT
         if TEST: break
     
     log_info(f"✓ Region {region_id} Completed. Total rows: {region_rows}")
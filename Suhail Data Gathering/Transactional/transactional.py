@@ -0,0 +1,977 @@
+#############################################################################################
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import csv
+import os
+import sys
+import json
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Dict, List, Optional, Set, Tuple
+import time
+import random
+import statistics
+from functools import lru_cache
+from collections import OrderedDict, defaultdict
+import threading
+import atexit
+try:
+    import orjson # Optional: much faster JSON encoding/decoding
+except ImportError:
+    orjson = None
+try:
+    import httpx # Optional: HTTP/2 for the per-transaction fan-out (pip install "httpx[http2]")
+except ImportError:
+    httpx = None
+#############################################################################################
+
+###### Configurations ######
+
+# API Endpoints
+REGIONS_URL = "https://api2.suhail.ai/regions"
+METRICS_URL = "https://api2.suhail.ai/api/mapMetrics/landMetrics/list"
+TRANSACTIONS_URL = "https://api2.suhail.ai/transactions/neighbourhood"
+TX_DETAILS_URL = "https://api2.suhail.ai/api/transactions/search"
+PARCEL_URL = "https://api2.suhail.ai/api/parcel/search"
+PRICE_METRICS_URL = "https://api2.suhail.ai/api/parcel/metrics/priceOfMeter"
+
+# Settings
+REGION_IDS = range(2, 17)
+METRICS_LIMIT = 600
+PAGE_SIZE = 1000
+PAGE_PREFETCH = 4  # Pages requested together once a paged listing returns a full page
+OUTPUT_FILE = "transactional_parcels.csv"
+HISTORY_FILE = "transaction_price_history.csv"
+TEST = False  # Set to True to test with small sample of data
+
+# Performance settings
+# OPTIMIZATION: Increased workers and split them by task type
+MAX_NEIGHBORHOOD_WORKERS = 10  # Process 10 neighborhoods in parallel
+MAX_DETAIL_WORKERS = 4         # Detail/geometry/metrics threads per neighborhood worker (shared pool)
+MAX_REGION_WORKERS = 3         # Regions listed in parallel; their neighborhoods share the pools above
+BATCH_SIZE = 25
+METRICS_BATCH_SIZE = 20
+REQUEST_TIMEOUT = 20           # Increased slightly for stability
+PAGE_TIMEOUT = 30              # Transaction pages and the metrics list are the large responses
+CONNECT_TIMEOUT = 5            # A dead connection fails fast; only reading gets the long timeouts
+API_QPS = float(os.environ.get("SUHAIL_QPS", 0))  # Request rate cap for the fan-out (0 = unlimited)
+CACHE_SIZE_LIMIT = 10000
+CACHE_DB = "suhail_cache.sqlite"  # Details/geometry fetched by earlier runs
+# SUHAIL_RESUME=1 skips neighborhoods whose rows an earlier run already wrote (tracked in CACHE_DB)
+RESUME = os.environ.get("SUHAIL_RESUME", "") == "1"
+# Without the earlier output file there is nothing to resume into
+RESUMING = RESUME and os.path.exists(OUTPUT_FILE)
+CHECKPOINT_EVERY = 50  # Finished neighborhoods between checkpoints
+
+#############################################################################################
+# Locks for Thread Safety
+csv_lock = threading.Lock()
+history_csv_lock = threading.Lock()
+print_lock = threading.Lock()
+cache_db_lock = threading.Lock()
+
+#############################################################################################
+class JitteredRetry(Retry):
+    """
+    Full-jitter backoff: sleeps a random time between 0 and the exponential delay,
+    so worker threads throttled together don't all retry in the same instant.
+    """
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+def create_session():
+    """Create a requests session with retry logic and connection pooling"""
+    session = requests.Session()
+    session.headers["Connection"] = "keep-alive"
+    
+    # All endpoints are on api2.suhail.ai, so a single host pool sized for every thread
+    # that can hold a request (neighborhood workers + shared fetch pool). pool_block makes
+    # a burst wait for a pooled connection instead of opening one that gets thrown away.
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max(MAX_NEIGHBORHOOD_WORKERS * (MAX_DETAIL_WORKERS + 1), 64),
+        pool_block=True,
+        max_retries=JitteredRetry(
+            total=4,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504, 429],
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+    )
+    
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+session = create_session()
+
+class StatusRetryClient:
+    """
+    httpx's transport only retries failed connections. This adds what the requests
+    session gets from JitteredRetry: 429 and 5xx responses are retried with full-jitter
+    backoff (or after Retry-After when the server sends one), and redirects are followed.
+    """
+    STATUS_FORCELIST = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, client, total, backoff_factor):
+        self.client = client
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.retry = JitteredRetry(total=total, backoff_factor=backoff_factor) # Retry-After parsing
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("follow_redirects", True)
+        for attempt in range(self.total + 1):
+            resp = self.client.get(url, **kwargs)
+            if resp.status_code not in self.STATUS_FORCELIST or attempt == self.total:
+                return resp
+            retry_after = resp.headers.get("Retry-After")
+            try:
+                delay = self.retry.parse_retry_after(retry_after) if retry_after else None
+            except Exception: # Malformed header: fall back to backoff
+                delay = None
+            if delay is None:
+                delay = random.uniform(0, self.backoff_factor * (2 ** attempt))
+            resp.close()
+            time.sleep(delay)
+
+    def close(self):
+        self.client.close()
+
+def create_fanout_client():
+    """
+    Transaction pages, details, geometry and price history are many small GETs to one
+    host: with httpx[http2] installed they are multiplexed over a few HTTP/2 connections.
+    Falls back to the pooled requests session otherwise.
+    """
+    if httpx:
+        try:
+            # Limits belong on the transport: the Client ignores its own once a transport is given
+            client = httpx.Client(transport=httpx.HTTPTransport(
+                http2=True, retries=2,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+            ))
+            return StatusRetryClient(client, total=4, backoff_factor=0.5)
+        except ImportError: # httpx without the h2 extra
+            pass
+    return session
+
+fanout_client = create_fanout_client()
+atexit.register(fanout_client.close)
+
+def fanout_timeout(read_timeout):
+    """Connect/read timeout in the form the fan-out client takes (httpx wants a Timeout, not a 2-tuple)"""
+    if fanout_client is session:
+        return (CONNECT_TIMEOUT, read_timeout)
+    return httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT)
+
+FANOUT_TIMEOUT = fanout_timeout(REQUEST_TIMEOUT)
+FANOUT_PAGE_TIMEOUT = fanout_timeout(PAGE_TIMEOUT)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a request may be sent, so
+    the worker pools stay under the server's rate instead of running into
+    429s and retry backoff. A rate of 0 disables the limit.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0: return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+api_limiter = TokenBucket(API_QPS)
+
+class LatencyConcurrency:
+    """
+    Limit on in-flight fan-out requests, tuned by latency. Every WINDOW requests the
+    window's median latency is compared with the best median seen so far: above 2x
+    the limit drops by one, under 1.2x (with no failures in the window) it grows by one.
+    """
+    WINDOW = 20
+
+    def __init__(self, initial, maximum, minimum=2):
+        self.limit = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.latencies = []
+        self.window_failed = False
+        self.baseline = None
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, ok):
+        with self.cond:
+            self.in_flight -= 1
+            self.latencies.append(latency)
+            self.window_failed = self.window_failed or not ok
+            if len(self.latencies) >= self.WINDOW:
+                median = statistics.median(self.latencies)
+                if self.baseline is None or median < self.baseline:
+                    self.baseline = median
+                if median > 2 * self.baseline:
+                    self.limit = max(self.minimum, self.limit - 1)
+                elif median < 1.2 * self.baseline and not self.window_failed:
+                    self.limit = min(self.maximum, self.limit + 1)
+                self.latencies = []
+                self.window_failed = False
+            self.cond.notify_all()
+
+    def get(self, client, url, **kwargs):
+        """
+        client.get() inside a concurrency slot, after waiting for api_limiter;
+        5xx, 429 and exceptions count as failures
+        """
+        api_limiter.acquire()
+        self.acquire()
+        ok = False
+        start = time.monotonic()
+        try:
+            resp = client.get(url, **kwargs)
+            ok = resp.status_code < 500 and resp.status_code != 429
+            return resp
+        finally:
+            self.release(time.monotonic() - start, ok)
+
+# The fetch pool has MAX_NEIGHBORHOOD_WORKERS * MAX_DETAIL_WORKERS threads; this decides how many
+# of them may actually hold a request at once
+fetch_concurrency = LatencyConcurrency(8, MAX_NEIGHBORHOOD_WORKERS * MAX_DETAIL_WORKERS)
+
+# Details, geometry and price history requests from all neighborhood workers share
+# one long-lived pool instead of each neighborhood spinning up its own executors.
+# Tasks in this pool never submit work themselves, so sharing it can't deadlock.
+fetch_executor = ThreadPoolExecutor(max_workers=MAX_NEIGHBORHOOD_WORKERS * MAX_DETAIL_WORKERS)
+atexit.register(fetch_executor.shutdown)
+# Neighborhood workers live for the whole run as well
+neighborhood_executor = ThreadPoolExecutor(max_workers=MAX_NEIGHBORHOOD_WORKERS)
+atexit.register(neighborhood_executor.shutdown)
+
+#############################################################################################
+# Caching
+class LimitedCache:
+    """Thread-safe LRU cache with size limit (OrderedDict keeps recency order, all operations O(1))"""
+    def __init__(self, max_size=1000):
+        self.cache = OrderedDict()
+        self.max_size = max_size
+        self.lock = threading.Lock() # OPTIMIZATION: Added lock
+    
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.cache.move_to_end(key)
+            except KeyError:
+                return default
+            return self.cache[key]
+    
+    def set(self, key, value):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            elif len(self.cache) >= self.max_size:
+                self.cache.popitem(last=False)
+            self.cache[key] = value
+    
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.cache
+
+# Cache miss marker, so a single get() tells a miss apart from a cached None/{}
+MISSING = object()
+
+class PersistentCache(LimitedCache):
+    """
+    LimitedCache backed by a SQLite table, so results fetched by earlier runs are
+    reused after a restart. In-memory misses fall through to the table. Only
+    non-empty values are persisted (in batches), so failed or empty lookups are
+    retried next run. Keys and values are stored as JSON.
+    """
+    WRITE_EVERY = 500
+
+    def __init__(self, db, table, max_size=1000):
+        super().__init__(max_size)
+        self.db = db
+        self.table = table
+        self.pending = []
+        with cache_db_lock:
+            db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT)")
+
+    def get(self, key, default=None):
+        value = super().get(key, MISSING)
+        if value is not MISSING:
+            return value
+        with cache_db_lock:
+            row = self.db.execute(f"SELECT value FROM {self.table} WHERE key = ?", (json_dumps(key),)).fetchone()
+        if row is None:
+            return default
+        value = json_loads(row[0])
+        super().set(key, value)
+        return value
+
+    def set(self, key, value):
+        super().set(key, value)
+        if not value: return
+        with cache_db_lock:
+            self.pending.append((json_dumps(key), json_dumps(value)))
+            if len(self.pending) >= self.WRITE_EVERY:
+                self._write_pending()
+
+    def flush(self):
+        with cache_db_lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        """One transaction per batch instead of a commit per insert. Caller holds cache_db_lock."""
+        if not self.pending: return
+        self.db.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)", self.pending)
+        self.db.commit()
+        self.pending = []
+
+# Shared by all worker threads, serialized by cache_db_lock
+cache_db = sqlite3.connect(CACHE_DB, check_same_thread=False)
+cache_db.execute("PRAGMA journal_mode=WAL")
+cache_db.execute("PRAGMA synchronous=NORMAL")
+atexit.register(cache_db.close)
+
+transaction_details_cache = PersistentCache(cache_db, "transaction_details", max_size=CACHE_SIZE_LIMIT)
+parcel_geometry_cache = PersistentCache(cache_db, "parcel_geometry", max_size=CACHE_SIZE_LIMIT)
+# blake2b digest of a geometry response body -> its decoded geometry
+geometry_body_cache = LimitedCache(max_size=CACHE_SIZE_LIMIT)
+# Registered after close, so they run before it
+atexit.register(transaction_details_cache.flush)
+atexit.register(parcel_geometry_cache.flush)
+
+#############################################################################################
+# JSON Helpers
+def json_loads(content):
+    """Parses a raw response body (orjson when available)"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def json_dumps(obj):
+    """Compact UTF-8 JSON string, same output with or without orjson"""
+    if orjson:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+#############################################################################################
+# Loggings
+PROGRESS_INTERVAL = 0.25  # Seconds between redraws of the progress line
+last_progress = 0.0
+
+def log_progress(msg):
+    """Print clean progress message overwriting current line (skipped if the last one was too recent)"""
+    global last_progress
+    with print_lock:
+        now = time.monotonic()
+        if now - last_progress < PROGRESS_INTERVAL: return
+        last_progress = now
+        sys.stdout.write(f"\r{msg.ljust(100)}")
+        sys.stdout.flush()
+
+def log_info(msg):
+    """Print permanent info message"""
+    with print_lock:
+        sys.stdout.write(f"\n{msg}")
+        sys.stdout.flush()
+
+#############################################################################################
+@lru_cache(maxsize=8192) # Few distinct subdivision numbers, checked once per geometry lookup
+def is_valid_subdivision(subdivision_no):
+    return subdivision_no and str(subdivision_no).strip().isdigit()
+
+#############################################################################################
+def needs_details_fetch(tx):
+    has_type = tx.get("type") is not None
+    has_metrics_type = tx.get("metricsType") is not None
+    has_total_area = tx.get("totalArea") is not None
+    if has_type and has_metrics_type and has_total_area:
+        return False
+    return True
+
+#############################################################################################
+def extract_coordinates(tx, details):
+    centroid_x = tx.get("centroidX")
+    centroid_y = tx.get("centroidY")
+    if centroid_x: return centroid_x, centroid_y
+    
+    centroid_x = details.get("centroidX")
+    centroid_y = details.get("centroidY")
+    if centroid_x: return centroid_x, centroid_y
+    
+    if details.get("centroid"):
+        return details["centroid"].get("x"), details["centroid"].get("y")
+    
+    if details.get("parcels") and len(details["parcels"]) > 0:
+        p = details["parcels"][0]
+        return p.get("centroidX"), p.get("centroidY")
+    
+    return None, None
+
+#############################################################################################
+def needs_geometry_fetch(tx, details, centroid_x):
+    if centroid_x: return False
+    if details.get("geometry") or details.get("polygonData"): return False
+    if not (tx.get("parcelNo") and tx.get("subdivisionNo")): return False
+    return True
+
+#############################################################################################
+def fetch_transaction_details(region_id: int, tx_number: str) -> dict:
+    """Raises on failure, so batch_fetch_details can keep errors out of the cache"""
+    resp = fetch_concurrency.get(
+        fanout_client,
+        TX_DETAILS_URL,
+        params={"transactionNo": tx_number, "regionId": region_id},
+        timeout=FANOUT_TIMEOUT
+    )
+    if resp.status_code in (204, 404, 410): return {}
+    resp.raise_for_status()
+    data = json_loads(resp.content).get("data", [])
+    return data[0] if data else {}
+
+#############################################################################################
+def fetch_parcel_geometry(region_id: int, province_id: int, subdivision_no: str, parcel_no: str) -> Optional[dict]:
+    """None when the parcel has no geometry; raises on failure so it isn't cached"""
+    if not is_valid_subdivision(subdivision_no):
+        return None
+    resp = fetch_concurrency.get(
+        fanout_client,
+        PARCEL_URL,
+        params={
+            "regionId": region_id,
+            "provinceId": province_id,
+            "subdivisionNo": subdivision_no,
+            "parcelNo": parcel_no,
+            "offset": 0,
+            "limit": 10
+        },
+        timeout=FANOUT_TIMEOUT
+    )
+    # Status checked inline: 404/410 and empty bodies mean "no geometry", other errors raise
+    if resp.status_code in (204, 404, 410): return None
+    resp.raise_for_status()
+    # Merged parcels come back with byte-identical bodies: decode those once and share the result
+    body_hash = hashlib.blake2b(resp.content, digest_size=16).digest()
+    geometry = geometry_body_cache.get(body_hash, MISSING)
+    if geometry is MISSING:
+        details = json_loads(resp.content).get("data", {}).get("parcelDetails", [])
+        geometry = details[0].get("geometry") if details else None
+        geometry_body_cache.set(body_hash, geometry)
+    return geometry
+
+#############################################################################################
+def fetch_price_metrics_batch(parcel_ids: List[int]) -> List[dict]:
+    """Fetch price metrics for a batch of parcel IDs"""
+    if not parcel_ids:
+        return []
+    
+    ids_str = ",".join(map(str, parcel_ids))
+    
+    try:
+        resp = fetch_concurrency.get(
+            fanout_client,
+            PRICE_METRICS_URL,
+            params={
+                "parcelObjsIds": ids_str,
+                "groupingType": "Monthly"
+            },
+            timeout=FANOUT_TIMEOUT
+        )
+        if resp.status_code >= 400 or resp.status_code == 204: return []
+        return json_loads(resp.content).get("data", [])
+    except Exception as e:
+        return []
+
+#############################################################################################
+def batch_fetch_details(region_id: int, tx_list: List[dict]) -> Dict[str, dict]:
+    results = {}
+    to_fetch: Set[str] = set() # A number listed twice is still requested once
+    
+    for tx in tx_list:
+        tx_number = tx.get("transactionNumber")
+        details = transaction_details_cache.get(tx_number, MISSING)
+        if details is not MISSING:
+            results[tx_number] = details
+        else:
+            to_fetch.add(tx_number)
+    
+    if not to_fetch:
+        return results
+    
+    future_to_tx = {
+        fetch_executor.submit(fetch_transaction_details, region_id, tx_num): tx_num 
+        for tx_num in to_fetch
+    }
+    # Results only go into dicts, so wait for the whole batch once instead of waking per future
+    done, _ = wait(future_to_tx)
+    for future in done:
+        tx_number = future_to_tx[future]
+        try:
+            details = future.result()
+            transaction_details_cache.set(tx_number, details)
+            results[tx_number] = details
+        except Exception:
+            results[tx_number] = {} # Not cached: a later run requests it again
+    return results
+
+#############################################################################################
+def batch_fetch_geometries(requests_list: List[Tuple]) -> Dict[Tuple, Optional[dict]]:
+    results = {}
+    to_fetch = []
+    
+    for req in requests_list:
+        geometry = parcel_geometry_cache.get(req, MISSING)
+        if geometry is not MISSING:
+            results[req] = geometry
+        elif not is_valid_subdivision(req[2]):
+            # No request possible for non-numeric subdivisions: settle them here instead of in a pool slot
+            results[req] = None
+            parcel_geometry_cache.set(req, None)
+        else:
+            to_fetch.append(req)
+    
+    if not to_fetch:
+        return results
+    
+    future_to_req = {
+        fetch_executor.submit(fetch_parcel_geometry, *req): req 
+        for req in to_fetch
+    }
+    done, _ = wait(future_to_req)
+    for future in done:
+        req = future_to_req[future]
+        try:
+            results[req] = future.result()
+            parcel_geometry_cache.set(req, results[req])
+        except Exception:
+            results[req] = None # Not cached: a later run requests it again
+    return results
+
+#############################################################################################
+def batch_process_metrics(transactions: List[dict]):
+    """Process price metrics for a list of transactions"""
+    id_map = {} 
+    ids_to_fetch = []
+    
+    for tx in transactions:
+        t_id = tx.get("parcelObjectId")
+        t_num = tx.get("transactionNumber")
+        if t_id:
+            ids_to_fetch.append(t_id)
+            id_map[t_id] = t_num
+
+    if not ids_to_fetch:
+        return
+
+    all_metrics_rows = []
+    
+    # fetch batches in parallel
+    batches = [ids_to_fetch[i:i + METRICS_BATCH_SIZE] for i in range(0, len(ids_to_fetch), METRICS_BATCH_SIZE)]
+    
+    futures = [fetch_executor.submit(fetch_price_metrics_batch, batch) for batch in batches]
+    
+    for future in as_completed(futures):
+        metrics_data = future.result()
+        
+        for item in metrics_data:
+            parcel_obj_id = item.get("parcelObjId")
+            neighborhood_id = item.get("neighborhoodId")
+            
+            # 1. Parcel Metrics
+            for pm in item.get("parcelMetrics", []):
+                all_metrics_rows.append((
+                    parcel_obj_id, id_map.get(parcel_obj_id, ""), neighborhood_id, "Parcel Specific",
+                    pm.get("month"), pm.get("year"), pm.get("metricsType"), pm.get("avaragePriceOfMeter")
+                ))
+                
+            # 2. Neighborhood Metrics
+            for nm in item.get("neighborhoodMetrics", []):
+                all_metrics_rows.append((
+                    parcel_obj_id, id_map.get(parcel_obj_id, ""), nm.get("neighborhoodId"), "Neighborhood Average",
+                    nm.get("month"), nm.get("year"), nm.get("metricsType"), nm.get("avaragePriceOfMeter")
+                ))
+
+    append_history_to_csv(all_metrics_rows)
+
+#############################################################################################
+# Output files stay open for the whole run: filename -> (file, csv.writer).
+# Rows are tuples in the file's column order, so the C writer formats them directly.
+csv_writers: Dict[str, Tuple] = {}
+
+def get_csv_writer(filename, fieldnames):
+    """
+    Opens the file for append on first use and writes the header only when the file
+    is new or empty. Writes go through a 1 MiB buffer, written out as it fills and when
+    the file is closed at exit. Callers hold that file's lock.
+    """
+    if filename not in csv_writers:
+        is_empty = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        f = open(filename, "a", newline="", encoding="utf-8-sig", buffering=1 << 20)
+        atexit.register(f.close)
+        writer = csv.writer(f)
+        if is_empty: writer.writerow(fieldnames)
+        csv_writers[filename] = (f, writer)
+    return csv_writers[filename]
+
+#############################################################################################
+# Resume state: neighborhoods whose rows are known to be in the output files
+with cache_db_lock:
+    # Keyed by OUTPUT_FILE: the scrapers share CACHE_DB, but each has its own checkpoints
+    cache_db.execute("CREATE TABLE IF NOT EXISTS finished_neighborhoods (output_file TEXT, region_id INTEGER, neighborhood_id INTEGER, PRIMARY KEY (output_file, region_id, neighborhood_id))")
+    if not RESUMING: cache_db.execute("DELETE FROM finished_neighborhoods WHERE output_file = ?", (OUTPUT_FILE,))
+    cache_db.commit()
+    done_neighborhoods = set(cache_db.execute("SELECT region_id, neighborhood_id FROM finished_neighborhoods WHERE output_file = ?", (OUTPUT_FILE,)))
+pending_done = [] # Finished since the last checkpoint, guarded by csv_lock
+
+def mark_neighborhood_done(region_id, neighborhood_id):
+    with csv_lock:
+        pending_done.append((OUTPUT_FILE, region_id, neighborhood_id))
+        if len(pending_done) < CHECKPOINT_EVERY: return
+    checkpoint()
+
+def checkpoint():
+    """
+    Flushes both CSVs and only then records the neighborhoods finished since the last
+    checkpoint, so a resumed run never skips a neighborhood whose rows were still buffered.
+    """
+    with csv_lock, history_csv_lock:
+        for f, _ in csv_writers.values():
+            if not f.closed: f.flush() # At exit the files may already be closed (which flushed them)
+        finished = pending_done[:]
+        pending_done.clear()
+    if not finished: return
+    with cache_db_lock:
+        cache_db.executemany("INSERT OR IGNORE INTO finished_neighborhoods VALUES (?, ?, ?)", finished)
+        cache_db.commit()
+
+atexit.register(checkpoint) # Runs before cache_db is closed
+
+#############################################################################################
+OUTPUT_FIELDNAMES = [
+    "regionId", "region_name", "region_centroid_x", "region_centroid_y",
+    "boundary_sw_x", "boundary_sw_y", "boundary_ne_x", "boundary_ne_y",
+    "region_image", "province_id", "provinceName", "province_centroid_x",
+    "province_centroid_y", "neighborhoodId", "neighborhoodName", "رقم الصفقة",
+    "رقم المخطط", "رقم البلوك", "رقم القطعة", "قيمة الصفقة (ï·¼)",
+    "سعر المتر (ï·¼)", "تاريخ الصفقة", "نوع الأرض", "نوع الاستخدام",
+    "المساحة الإجمالية", "المصدر", "sellingType", "landUseGroup",
+    "propertyType", "centroidX", "centroidY", "parcelObjId",
+    "polygonData", "geometry",
+]
+
+def append_to_csv(new_rows):
+    if not new_rows: return
+    # OPTIMIZATION: Thread-safe writing
+    with csv_lock:
+        _, writer = get_csv_writer(OUTPUT_FILE, OUTPUT_FIELDNAMES)
+        writer.writerows(new_rows)
+
+#############################################################################################
+HISTORY_FIELDNAMES = ["parcelObjId", "transactionNumber", "neighborhoodId", "type", "month", "year", "metricsType", "averagePriceOfMeter"]
+
+def append_history_to_csv(new_rows):
+    """Append price history metrics to separate CSV"""
+    if not new_rows: return
+    
+    # OPTIMIZATION: Thread-safe writing
+    with history_csv_lock:
+        _, writer = get_csv_writer(HISTORY_FILE, HISTORY_FIELDNAMES)
+        writer.writerows(new_rows)
+
+#############################################################################################
+def build_row(region_id, province_id, province_name, neighborhood_id, neighborhood_name, tx, details, geometry=None, region_dict=None, province_dict=None, coordinates=None):
+    """Output row as a tuple in OUTPUT_FIELDNAMES order. coordinates: extract_coordinates() result if already known"""
+    # Bound once: the getters are called ~30 times per row
+    t = tx.get
+    d = details.get if details else (lambda key: "")
+    centroid_x, centroid_y = coordinates or extract_coordinates(tx, details)
+    
+    region_data = region_dict.get(region_id, {})
+    region_centroid = region_data.get("centroid", {})
+    boundary = region_data.get("restrictBoundaryBox", {})
+    southwest = boundary.get("southwest", {})
+    northeast = boundary.get("northeast", {})
+    province_centroid = province_dict.get(province_id, {}).get("centroid", {})
+    polygon_data = d("polygonData")
+    geometry = d("geometry") or geometry
+    
+    return (
+        region_id,
+        region_data.get("name", ""),
+        region_centroid.get("x", ""),
+        region_centroid.get("y", ""),
+        southwest.get("x", ""),
+        southwest.get("y", ""),
+        northeast.get("x", ""),
+        northeast.get("y", ""),
+        region_data.get("image", ""),
+        province_id or "",
+        province_name or "",
+        province_centroid.get("x", ""),
+        province_centroid.get("y", ""),
+        neighborhood_id,
+        neighborhood_name,
+        t("transactionNumber") or "",
+        t("subdivisionNo") or "",
+        t("blockNo") or "---",
+        t("parcelNo") or "",
+        t("transactionPrice") or "",
+        t("priceOfMeter") or "",
+        t("transactionDate") or "",
+        d("type"),
+        d("metricsType"),
+        d("totalArea"),
+        d("transactionSource"),
+        d("sellingType"),
+        d("landUseGroup"),
+        d("propertyType"),
+        centroid_x or "",
+        centroid_y or "",
+        t("parcelObjectId", ""),
+        json_dumps(polygon_data) if polygon_data else "",
+        json_dumps(geometry) if geometry else "",
+    )
+
+#############################################################################################
+def fetch_regions():
+    response = session.get(REGIONS_URL, timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT))
+    response.raise_for_status()
+    regions = json_loads(response.content)["data"]
+    r_dict, p_dict = {}, {}
+    for r in regions:
+        r_dict[r["id"]] = r
+        for p in r.get("provinces", []):
+            p_dict[p["id"]] = p
+    return r_dict, p_dict
+
+#############################################################################################
+def fetch_transactions_page(region_id, neighborhood_id, page):
+    tx_resp = fetch_concurrency.get(
+        fanout_client,
+        TRANSACTIONS_URL,
+        params={"regionId": region_id, "neighbourhoodId": neighborhood_id, "page": page, "pageSize": PAGE_SIZE},
+        timeout=FANOUT_PAGE_TIMEOUT
+    )
+    if tx_resp.status_code == 204: return [] # Ends pagination
+    tx_resp.raise_for_status() # Still failing after retries: the listing is incomplete
+    return json_loads(tx_resp.content).get("data", [])
+
+def iter_pages(fetch_page, page_size):
+    """
+    Yields fetch_page(0), fetch_page(1), ... up to the first empty page; errors propagate.
+    Once a page comes back full (page_size items), the next PAGE_PREFETCH pages are
+    requested together and the first short one among them is the last page.
+    """
+    page = 0
+    window = 1
+    while True:
+        futures = [fetch_executor.submit(fetch_page, p) for p in range(page, page + window)]
+        try:
+            for future in futures:
+                items = future.result()
+                if not items: return
+                yield items
+                if window > 1 and len(items) < page_size: return
+        finally:
+            for f in futures: f.cancel() # Pages past the end that haven't started yet
+        page += window
+        window = PAGE_PREFETCH if len(items) >= page_size else 1
+
+def fetch_neighborhood_transactions(region_id, neighborhood_id):
+    """
+    All transaction pages of a neighborhood, up to the first empty (or short) page.
+    Returns (transactions, complete); complete is False if a page failed to load.
+    """
+    all_transactions = []
+    try:
+        for txs in iter_pages(lambda page: fetch_transactions_page(region_id, neighborhood_id, page), PAGE_SIZE):
+            all_transactions.extend(txs)
+            if TEST: break
+    except Exception:
+        return all_transactions, False
+    return all_transactions, True
+
+#############################################################################################
+def process_neighborhood(item, region_id, region_dict, province_dict):
+    """Refactored to run as a single worker task"""
+    neighborhood_id = item["neighborhoodId"]
+    neighborhood_name = item["neighborhoodName"]
+    # log_progress(f"   Starting Neighborhood: {neighborhood_name} ({neighborhood_id})")
+
+    # Fetch Transactions
+    all_transactions, complete = fetch_neighborhood_transactions(region_id, neighborhood_id)
+    if not complete:
+        # Nothing written or checkpointed, so a resumed run fetches it again from scratch
+        log_info(f"Error fetching transactions of {neighborhood_name} ({neighborhood_id}), skipped")
+        return 0
+    
+    if not all_transactions: 
+        mark_neighborhood_done(region_id, neighborhood_id)
+        return 0
+
+    # Filter Duplicates
+    # Duplicates only come from overlapping pages of this neighborhood's listing, so the
+    # seen set lives just for this call instead of growing for the whole run
+    new_transactions = []
+    seen = set()
+    for tx in all_transactions:
+        tx_number = tx.get("transactionNumber")
+        if tx_number not in seen:
+            seen.add(tx_number)
+            new_transactions.append(tx)
+    
+    if not new_transactions: 
+        mark_neighborhood_done(region_id, neighborhood_id)
+        return 0
+
+    # 1. Fetch Details
+    tx_needing_details = [tx for tx in new_transactions if needs_details_fetch(tx)]
+    details_map = batch_fetch_details(region_id, tx_needing_details) if tx_needing_details else {}
+    
+    # 2. Prepare Details Map for all
+    # Transactions that already carry the detail fields are their own details
+    # (same key names), so they're used as-is instead of copied into a new dict
+    for tx in new_transactions:
+        if tx.get("transactionNumber") not in details_map:
+            details_map[tx.get("transactionNumber")] = tx
+
+    # 3. Fetch Geometries
+    # Parcel request -> transactions wanting it: parcels repeat across a neighborhood's
+    # transactions but are requested once each
+    req_to_txs = defaultdict(list)
+    coords_map = {} # Reused by build_row below
+    for tx in new_transactions:
+        details = details_map.get(tx.get("transactionNumber"), {})
+        coords_map[tx.get("transactionNumber")] = coords = extract_coordinates(tx, details)
+        if needs_geometry_fetch(tx, details, coords[0]):
+            prov_id = details.get("provinceId") or item.get("provinceId")
+            if tx.get("parcelNo") and tx.get("subdivisionNo") and prov_id:
+                req_to_txs[(region_id, prov_id, tx.get("subdivisionNo"), tx.get("parcelNo"))].append(tx.get("transactionNumber"))
+    
+    geo_map = {}
+    if req_to_txs:
+        geo_results = batch_fetch_geometries(list(req_to_txs))
+        geo_map = {tnum: geo_results.get(req) for req, tnums in req_to_txs.items() for tnum in tnums}
+
+    # 4. Fetch Price History Metrics
+    batch_process_metrics(new_transactions)
+
+    # 5. Save Rows
+    rows_to_save = []
+    for tx in new_transactions:
+        tnum = tx.get("transactionNumber")
+        details = details_map.get(tnum, {})
+        geom = geo_map.get(tnum)
+        prov_id = details.get("provinceId") or item.get("provinceId")
+        
+        rows_to_save.append(build_row(
+            region_id, prov_id, item.get("provinceName"), neighborhood_id, 
+            neighborhood_name, tx, details, geom, region_dict, province_dict, coords_map.get(tnum)
+        ))
+    
+    append_to_csv(rows_to_save)
+    mark_neighborhood_done(region_id, neighborhood_id)
+    
+    # Log completion for this neighborhood
+    log_progress(f"   Processed {neighborhood_name}: {len(rows_to_save)} items")
+    return len(rows_to_save)
+
+#############################################################################################
+def fetch_metrics_page(region_id, offset):
+    metrics_resp = session.get(METRICS_URL, params={"regionId": region_id, "offset": offset, "limit": METRICS_LIMIT}, timeout=(CONNECT_TIMEOUT, PAGE_TIMEOUT))
+    metrics_resp.raise_for_status()
+    return json_loads(metrics_resp.content).get("data", {}).get("items", [])
+
+#############################################################################################
+def process_region(region_id, region_dict, province_dict):
+    log_info(f">> Starting Region {region_id}: {region_dict.get(region_id, {}).get('name', 'Unknown')}")
+    region_rows = 0
+    futures = []
+    
+    # Fetch Neighborhoods (Metrics), several pages at a time once they come back full
+    try:
+        for items in iter_pages(lambda page: fetch_metrics_page(region_id, page * METRICS_LIMIT), METRICS_LIMIT):
+            if TEST: items = items[:3]
+            if RESUMING:
+                items = [item for item in items if (region_id, item["neighborhoodId"]) not in done_neighborhoods]
+
+            log_info(f"   Fetched {len(items)} neighborhoods")
+
+            # parallel Neighborhood Processing
+            # Queued on the shared pool without waiting: the next metrics page is fetched
+            # while these neighborhoods are still being processed
+            futures.extend(
+                neighborhood_executor.submit(process_neighborhood, item, region_id, region_dict, province_dict)
+                for item in items
+            )
+
+            if TEST: break
+    except Exception as e:
+        log_info(f"Error fetching metrics list: {e}")
+    
+    # Gather results
+    for future in as_completed(futures):
+        try:
+            region_rows += future.result()
+        except Exception as e:
+            # Log error but continue
+            pass
+    
+    log_info(f"✓ Region {region_id} Completed. Total rows: {region_rows}")
+    return region_rows
+
+#############################################################################################
+if __name__ == "__main__":
+    print(f"{'='*60}")
+    print(f"SUHAIL.AI SCRAPER - OPTIMIZED")
+    print(f"Main Data: {OUTPUT_FILE}")
+    print(f"Price History: {HISTORY_FILE}")
+    print(f"{'='*60}")
+    
+    start_t = time.time()
+    total_r = 0
+    
+    try:
+        log_info("Fetching metadata (Regions/Provinces)...")
+        r_dict, p_dict = fetch_regions()
+        
+        # Regions are independent: while one is still draining its last neighborhoods,
+        # the next ones are already listing theirs and keeping the shared pools busy
+        region_executor = ThreadPoolExecutor(max_workers=MAX_REGION_WORKERS)
+        region_futures = [region_executor.submit(process_region, rid, r_dict, p_dict) for rid in REGION_IDS]
+        try:
+            for future in as_completed(region_futures):
+                total_r += future.result()
+        finally:
+            region_executor.shutdown(wait=False, cancel_futures=True)
+            
+    except KeyboardInterrupt:
+        log_info(" ----- Scraper interrupted by user -----")
+    except Exception as e:
+        log_info(f"------ Critical Error: {e} ------")
+    
+    elapsed = time.time() - start_t
+    print(f"\n{'='*60}")
+    print(f"DONE. Processed {total_r} transactions in {elapsed/60:.1f} min.")
\ No newline at end of file